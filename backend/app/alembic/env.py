@@ -1,6 +1,6 @@
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
-from sqlalchemy import pool
+from sqlalchemy import pool, make_url
 from alembic import context
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -19,7 +19,9 @@ if _db_url:
     config.set_main_option("sqlalchemy.url", _db_url)
 # --- konec bloku ---
 
-fileConfig(config.config_file_name)
+# app.db.migrate passes its own (locked) connection; leave the app's logging alone then
+if config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name)
 
 def run_migrations_offline():
     url = settings.DATABASE_URL
@@ -27,17 +29,25 @@ def run_migrations_offline():
     with context.begin_transaction():
         context.run_migrations()
 
+def _run(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
 def run_migrations_online():
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    # alembic itself is synchronous: swap the asyncpg driver for psycopg2
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix='sqlalchemy.',
         poolclass=pool.NullPool,
-        url=settings.DATABASE_URL,
+        url=make_url(settings.DATABASE_URL).set(drivername="postgresql+psycopg2"),
     )
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
-        with context.begin_transaction():
-            context.run_migrations()
+        _run(connection)
 
 if context.is_offline_mode():
     run_migrations_offline()
@@ -0,0 +1,45 @@
+"""sessions: partial indexes for open-session lookup and stopped count
+
+Revision ID: 0003_session_indexes
+Revises: 0002_orders
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0003_session_indexes'
+down_revision = '0002_orders'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        # open session per (card, machine, operator), newest first; id is
+        # included so the scan toggle is an index-only lookup
+        op.create_index(
+            'ix_sessions_open',
+            'sessions',
+            ['job_card_id', 'machine_id', 'operator_id', sa.text('start_ts DESC')],
+            postgresql_where=sa.text("status = 'started'"),
+            postgresql_include=['id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # pieces done per job card
+        op.create_index(
+            'ix_sessions_stopped_card',
+            'sessions',
+            ['job_card_id'],
+            postgresql_where=sa.text("status = 'stopped'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_sessions_stopped_card', table_name='sessions', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_sessions_open', table_name='sessions', postgresql_concurrently=True, if_exists=True)
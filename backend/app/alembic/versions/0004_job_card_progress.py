@@ -0,0 +1,52 @@
+"""job_card_progress: incrementally maintained per-card counters
+
+Revision ID: 0004_job_card_progress
+Revises: 0003_session_indexes
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004_job_card_progress'
+down_revision = '0003_session_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_card_progress',
+        sa.Column('job_card_id', sa.Integer(), sa.ForeignKey('job_cards.id'), primary_key=True),
+        sa.Column('done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('planned', sa.Integer(), nullable=False, server_default='1'),
+        sa.Column('total_seconds', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('first_start', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_stop', sa.DateTime(timezone=True), nullable=True),
+    )
+    # backfill from history so existing cards keep their counts
+    op.execute("""
+        INSERT INTO job_card_progress (job_card_id, done, planned, total_seconds, first_start, last_stop)
+        SELECT jc.id, count(s.id), COALESCE(d.planned_pieces, 1),
+               COALESCE(sum(s.duration_seconds), 0), min(s.start_ts), max(s.stop_ts)
+        FROM job_cards jc
+        LEFT JOIN drawings d ON d.id = jc.drawing_id
+        LEFT JOIN sessions s ON s.job_card_id = jc.id AND s.status = 'stopped'
+        GROUP BY jc.id, d.planned_pieces
+    """)
+    # nothing counts a card's stopped sessions any more; the index only slowed every stop
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_sessions_stopped_card', table_name='sessions', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_sessions_stopped_card',
+            'sessions',
+            ['job_card_id'],
+            postgresql_where=sa.text("status = 'stopped'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+    op.drop_table('job_card_progress')
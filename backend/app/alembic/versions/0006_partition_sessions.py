@@ -0,0 +1,116 @@
+"""sessions: range-partition by start_ts, one partition per month
+
+Revision ID: 0006_partition_sessions
+Revises: 0005_idempotency_keys
+Create Date: 2026-10-18 00:00:00.000000
+
+Rewrites the whole table, so run it in a maintenance window. Later months are
+created by the worker (maintain_session_partitions).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0006_partition_sessions'
+down_revision = '0005_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, job_card_id, operator_id, machine_id, piece_index, start_ts, stop_ts, duration_seconds, status, meta"
+
+
+def _constraints_and_indexes():
+    op.create_foreign_key('sessions_job_card_id_fkey', 'sessions', 'job_cards', ['job_card_id'], ['id'])
+    op.create_foreign_key('sessions_operator_id_fkey', 'sessions', 'users', ['operator_id'], ['id'])
+    op.create_foreign_key('sessions_machine_id_fkey', 'sessions', 'machines', ['machine_id'], ['id'])
+    op.create_index(
+        'ix_sessions_open',
+        'sessions',
+        ['job_card_id', 'machine_id', 'operator_id', sa.text('start_ts DESC')],
+        postgresql_where=sa.text("status = 'started'"),
+        postgresql_include=['id'],
+    )
+
+
+def upgrade():
+    op.execute("ALTER TABLE sessions RENAME TO sessions_unpartitioned")
+    op.execute("ALTER TABLE sessions_unpartitioned DROP CONSTRAINT sessions_pkey")
+    op.execute("DROP INDEX IF EXISTS ix_sessions_open")
+    op.execute("ALTER TABLE sessions_unpartitioned DROP CONSTRAINT IF EXISTS uniq_piece_owner")
+
+    # same columns and id sequence, partition key made mandatory
+    op.execute("CREATE TABLE sessions (LIKE sessions_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (start_ts)")
+    op.execute("ALTER SEQUENCE sessions_id_seq OWNED BY sessions.id")
+    op.execute("ALTER TABLE sessions ALTER COLUMN start_ts SET DEFAULT now(), ALTER COLUMN start_ts SET NOT NULL")
+    op.create_primary_key('sessions_pkey', 'sessions', ['id', 'start_ts'])
+    _constraints_and_indexes()
+
+    # default partition plus one per month from the oldest row to 3 months ahead
+    op.execute("""
+        DO $$
+        DECLARE
+            m date := date_trunc('month', LEAST(
+                (SELECT min(COALESCE(start_ts, stop_ts)) FROM sessions_unpartitioned), now()) AT TIME ZONE 'UTC')::date;
+            last date := (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months')::date;
+        BEGIN
+            CREATE TABLE sessions_default PARTITION OF sessions DEFAULT;
+            WHILE m <= last LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF sessions FOR VALUES FROM (%L) TO (%L)',
+                               'sessions_' || to_char(m, 'YYYY_MM'),
+                               to_char(m, 'YYYY-MM-DD') || ' 00:00:00+00',
+                               to_char(m + interval '1 month', 'YYYY-MM-DD') || ' 00:00:00+00');
+                m := (m + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+    op.execute(f"""
+        INSERT INTO sessions ({COLUMNS})
+        SELECT id, job_card_id, operator_id, machine_id, piece_index,
+               COALESCE(start_ts, stop_ts, now()), stop_ts, duration_seconds, status, meta
+        FROM sessions_unpartitioned
+    """)
+    op.execute("DROP TABLE sessions_unpartitioned")
+
+    # uniq_piece_owner per partition; history written before the constraint
+    # existed may hold duplicates, those months get a plain index instead
+    op.execute("""
+        DO $$
+        DECLARE p text;
+        BEGIN
+            FOR p IN SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                     WHERE i.inhparent = 'sessions'::regclass LOOP
+                BEGIN
+                    EXECUTE format('CREATE UNIQUE INDEX %I ON %I (job_card_id, machine_id, operator_id, piece_index)',
+                                   p || '_piece_owner', p);
+                EXCEPTION WHEN unique_violation THEN
+                    EXECUTE format('CREATE INDEX %I ON %I (job_card_id, machine_id, operator_id, piece_index)',
+                                   p || '_piece_owner', p);
+                END;
+            END LOOP;
+        END $$
+    """)
+
+
+def downgrade():
+    op.execute("ALTER TABLE sessions RENAME TO sessions_partitioned")
+    op.execute("ALTER TABLE sessions_partitioned DROP CONSTRAINT sessions_pkey")
+    op.execute("DROP INDEX ix_sessions_open")
+
+    op.execute("CREATE TABLE sessions (LIKE sessions_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER SEQUENCE sessions_id_seq OWNED BY sessions.id")
+    op.create_primary_key('sessions_pkey', 'sessions', ['id'])
+    _constraints_and_indexes()
+    op.execute(f"INSERT INTO sessions ({COLUMNS}) SELECT {COLUMNS} FROM sessions_partitioned")
+    op.execute("DROP TABLE sessions_partitioned")
+
+    # back to one table-wide uniq_piece_owner; as on the way up, duplicates
+    # from before the constraint leave a plain index instead
+    op.execute("""
+        DO $$
+        BEGIN
+            ALTER TABLE sessions ADD CONSTRAINT uniq_piece_owner
+                UNIQUE (job_card_id, piece_index, machine_id, operator_id);
+        EXCEPTION WHEN unique_violation THEN
+            CREATE INDEX uniq_piece_owner ON sessions (job_card_id, piece_index, machine_id, operator_id);
+        END $$
+    """)
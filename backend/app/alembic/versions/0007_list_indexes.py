@@ -0,0 +1,39 @@
+"""jobs, machines: (name, id) indexes for keyset-paginated admin lists
+
+Revision ID: 0007_list_indexes
+Revises: 0006_partition_sessions
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0007_list_indexes'
+down_revision = '0006_partition_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        # same expression the list endpoint sorts on, NULL names first
+        op.create_index(
+            'ix_jobs_name_id',
+            'jobs',
+            [sa.text("coalesce(name, '')"), 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            'ix_machines_name_id',
+            'machines',
+            ['name', 'id'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_machines_name_id', table_name='machines', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_jobs_name_id', table_name='jobs', postgresql_concurrently=True, if_exists=True)
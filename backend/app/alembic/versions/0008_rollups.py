@@ -0,0 +1,72 @@
+"""machine_hourly_stats, operator_daily_stats: session rollups with a watermark
+
+Revision ID: 0008_rollups
+Revises: 0007_list_indexes
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0008_rollups'
+down_revision = '0007_list_indexes'
+branch_labels = None
+depends_on = None
+
+# name -> (columns, where)
+SESSION_INDEXES = {
+    'ix_sessions_stopped_updated': ("updated_at, id", "WHERE status = 'stopped'"),
+    'ix_sessions_start_ts': ("start_ts", ""),
+}
+
+
+def _stats_table(name, dim, fk, bucket, bucket_type):
+    op.create_table(
+        name,
+        sa.Column(dim, sa.Integer(), sa.ForeignKey(fk), primary_key=True),
+        sa.Column(bucket, bucket_type, primary_key=True),
+        sa.Column('pieces', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('busy_seconds', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('run_seconds', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('planned_seconds', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('first_start', sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def upgrade():
+    # now() is stable, so this is a metadata-only change; existing rows all
+    # get the migration time and the first rollup run backfills them
+    op.add_column('sessions', sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False,
+                                        server_default=sa.func.now()))
+    _stats_table('machine_hourly_stats', 'machine_id', 'machines.id', 'hour', sa.DateTime(timezone=True))
+    _stats_table('operator_daily_stats', 'operator_id', 'users.id', 'day', sa.Date())
+    op.create_table(
+        'rollup_watermarks',
+        sa.Column('name', sa.String(64), primary_key=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('session_id', sa.Integer(), nullable=False),
+    )
+
+    # partitioned indexes cannot be built concurrently: create them invalid
+    # on the parent only, build each partition's concurrently and attach
+    for name, (cols, where) in SESSION_INDEXES.items():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY sessions ({cols}) {where}")
+    partitions = [r[0] for r in op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST('sessions' AS regclass) ORDER BY c.relname"
+    ))]
+    with op.get_context().autocommit_block():
+        for part in partitions:
+            for name, (cols, where) in SESSION_INDEXES.items():
+                index = f"{part}_{name[len('ix_sessions_'):]}"
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {part} ({cols}) {where}")
+                op.execute(f"ALTER INDEX {name} ATTACH PARTITION {index}")
+
+
+def downgrade():
+    for name in SESSION_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.drop_table('rollup_watermarks')
+    op.drop_table('operator_daily_stats')
+    op.drop_table('machine_hourly_stats')
+    op.drop_column('sessions', 'updated_at')
@@ -0,0 +1,40 @@
+"""duration_sketches: per drawing and machine piece-time histograms
+
+Revision ID: 0009_duration_sketches
+Revises: 0008_rollups
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0009_duration_sketches'
+down_revision = '0008_rollups'
+branch_labels = None
+depends_on = None
+
+# app.services.sketch.BUCKET_SQL at the time of this revision (1% accuracy)
+BUCKET = "CAST(CEIL(LN(GREATEST(s.duration_seconds, 1)) / 0.020000666706669435) AS integer)"
+
+
+def upgrade():
+    op.create_table(
+        'duration_sketches',
+        sa.Column('drawing_id', sa.Integer(), sa.ForeignKey('drawings.id'), primary_key=True),
+        sa.Column('machine_id', sa.Integer(), sa.ForeignKey('machines.id'), primary_key=True),
+        sa.Column('bucket', sa.Integer(), primary_key=True),
+        sa.Column('n', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    # backfill from history so estimates are there from the start
+    op.execute(f"""
+        INSERT INTO duration_sketches (drawing_id, machine_id, bucket, n)
+        SELECT jc.drawing_id, s.machine_id, {BUCKET}, count(*)
+        FROM sessions s
+        JOIN job_cards jc ON jc.id = s.job_card_id
+        WHERE s.status = 'stopped' AND s.duration_seconds IS NOT NULL AND s.machine_id IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade():
+    op.drop_table('duration_sketches')
@@ -0,0 +1,31 @@
+"""sessions: partial start_ts index over open sessions for the stale sweeper
+
+Revision ID: 0010_started_sessions_index
+Revises: 0009_duration_sketches
+Create Date: 2026-10-18 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0010_started_sessions_index'
+down_revision = '0009_duration_sketches'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # same per-partition concurrent build as 0008
+    op.execute("CREATE INDEX IF NOT EXISTS ix_sessions_started_ts ON ONLY sessions (start_ts) WHERE status = 'started'")
+    partitions = [r[0] for r in op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST('sessions' AS regclass) ORDER BY c.relname"
+    ))]
+    with op.get_context().autocommit_block():
+        for part in partitions:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {part}_started_ts ON {part} (start_ts) WHERE status = 'started'")
+            op.execute(f"ALTER INDEX ix_sessions_started_ts ATTACH PARTITION {part}_started_ts")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_sessions_started_ts")
@@ -1,22 +1,69 @@
-from fastapi import APIRouter, Depends
-from app.db.session import AsyncSessionLocal
-from app.db.models import Job, Machine, User
-from sqlalchemy import select
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from app.db.deps import get_read_db, DBRoute
+from app.db.models import Job, Machine
+from app.services import listing
 
-router = APIRouter()
+router = APIRouter(route_class=DBRoute)
 
-async def get_db():
-    async with AsyncSessionLocal() as s:
-        yield s
+# sort name -> (column to order by, its value in a result row)
+JOB_SORTS = {
+    "id": (Job.id, lambda r: r["id"]),
+    "name": (func.coalesce(Job.name, ""), lambda r: r["name"] or ""),
+}
+MACHINE_SORTS = {
+    "id": (Machine.id, lambda r: r["id"]),
+    "name": (Machine.name, lambda r: r["name"]),
+}
+SORT_PATTERN = "^-?(id|name)$"
+
+def _jobs_query(q, customer):
+    stmt = select(Job.id, Job.name, Job.customer)
+    if q:
+        stmt = stmt.where(listing.contains(Job.name, q))
+    if customer is not None:
+        stmt = stmt.where(Job.customer == customer)
+    return stmt
+
+def _machines_query(q):
+    stmt = select(Machine.id, Machine.name)
+    if q:
+        stmt = stmt.where(listing.contains(Machine.name, q))
+    return stmt
+
+async def _page(db, stmt, sorts, sort, cursor, limit):
+    col, value = sorts[sort.lstrip("-")]
+    try:
+        stmt = listing.ordered(stmt, sort, col, stmt.selected_columns.id, cursor)
+    except listing.BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await listing.page(db, stmt, sort, value, limit)
+
+def _export(db, stmt, sorts, sort):
+    col, _ = sorts[sort.lstrip("-")]
+    stmt = listing.ordered(stmt, sort, col, stmt.selected_columns.id)
+    return StreamingResponse(listing.ndjson(db, stmt), media_type="application/x-ndjson")
 
 @router.get('/jobs/list')
-async def list_jobs(db=Depends(get_db)):
-    r = await db.execute(select(Job))
-    rows = r.scalars().all()
-    return [{"id":row.id,"name":row.name} for row in rows]
+async def list_jobs(q: Optional[str] = None, customer: Optional[str] = None,
+                    sort: str = Query("id", pattern=SORT_PATTERN), cursor: Optional[str] = None,
+                    limit: int = Query(100, ge=1, le=1000), db=Depends(get_read_db)):
+    return await _page(db, _jobs_query(q, customer), JOB_SORTS, sort, cursor, limit)
+
+@router.get('/jobs/export')
+async def export_jobs(q: Optional[str] = None, customer: Optional[str] = None,
+                      sort: str = Query("id", pattern=SORT_PATTERN), db=Depends(get_read_db)):
+    return _export(db, _jobs_query(q, customer), JOB_SORTS, sort)
 
 @router.get('/machines/list')
-async def list_machines(db=Depends(get_db)):
-    r = await db.execute(select(Machine))
-    rows = r.scalars().all()
-    return [{"id":row.id,"name":row.name} for row in rows]
+async def list_machines(q: Optional[str] = None, sort: str = Query("id", pattern=SORT_PATTERN),
+                        cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=1000),
+                        db=Depends(get_read_db)):
+    return await _page(db, _machines_query(q), MACHINE_SORTS, sort, cursor, limit)
+
+@router.get('/machines/export')
+async def export_machines(q: Optional[str] = None, sort: str = Query("id", pattern=SORT_PATTERN),
+                          db=Depends(get_read_db)):
+    return _export(db, _machines_query(q), MACHINE_SORTS, sort)
@@ -0,0 +1,8 @@
+from fastapi import APIRouter
+from app.db.session import pool_stats, replica_stats
+
+router = APIRouter()
+
+@router.get("/debug/pool")
+async def debug_pool():
+    return {**pool_stats(), "replica": replica_stats()}
@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.services import events
+import asyncio, json
+
+router = APIRouter()
+
+async def _next(sub: events.Subscriber, seen_dropped: int):
+    """Next payload for a subscriber; tells the client when events were lost."""
+    if sub.dropped != seen_dropped:
+        return sub.dropped, json.dumps({"type": "dropped", "count": sub.dropped - seen_dropped})
+    return seen_dropped, await sub.queue.get()
+
+@router.get("/events")
+async def event_stream(request: Request):
+    sub = events.subscribe()
+
+    async def stream():
+        dropped = 0
+        try:
+            yield ": connected\n\n"
+            while not await request.is_disconnected():
+                try:
+                    dropped, data = await asyncio.wait_for(_next(sub, dropped), settings.EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {data}\n\n"
+        finally:
+            events.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _send_events(ws: WebSocket, sub: events.Subscriber):
+    dropped = 0
+    while True:
+        dropped, data = await _next(sub, dropped)
+        await ws.send_text(data)
+
+async def _until_closed(ws: WebSocket):
+    # clients only listen; reading is what notices a close while no events come
+    while (await ws.receive())["type"] != "websocket.disconnect":
+        pass
+
+@router.websocket("/events/ws")
+async def event_socket(ws: WebSocket):
+    await ws.accept()
+    sub = events.subscribe()
+    tasks = [asyncio.create_task(_send_events(ws, sub)), asyncio.create_task(_until_closed(ws))]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        events.unsubscribe(sub)
@@ -0,0 +1,31 @@
+import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from app.db.deps import get_read_db, DBRoute
+from app.services import exports
+from app.services.listing import as_utc
+
+router = APIRouter(route_class=DBRoute)
+
+@router.get("/exports/sessions")
+async def export_sessions(start: datetime.datetime, end: datetime.datetime,
+                          format: str = Query("csv", pattern="^(csv|xlsx)$"), gzip: bool = False,
+                          job_id: Optional[int] = None, job_card_id: Optional[int] = None,
+                          operator_id: Optional[int] = None, machine_id: Optional[int] = None,
+                          status: Optional[str] = Query(None, pattern="^(started|stopped|cancelled)$"),
+                          db=Depends(get_read_db)):
+    """Sessions started in [start, end) with job, drawing, operator and machine names."""
+    start, end = as_utc(start), as_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if gzip and format == "xlsx":
+        raise HTTPException(status_code=400, detail="xlsx is already compressed")
+    filters = {"job_id": job_id, "job_card_id": job_card_id, "operator_id": operator_id,
+               "machine_id": machine_id, "status": status}
+    media_type, ext = exports.FORMATS[format]
+    if gzip:
+        media_type, ext = "application/gzip", ext + ".gz"
+    name = f"sessions_{start:%Y%m%d}-{end:%Y%m%d}.{ext}"
+    return StreamingResponse(exports.stream(db, format, start, end, filters, gzip),
+                             media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{name}"'})
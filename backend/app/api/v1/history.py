@@ -0,0 +1,22 @@
+import datetime, json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from app.db.deps import get_read_db, DBRoute
+from app.services import archive
+from app.services.listing import as_utc
+
+router = APIRouter(route_class=DBRoute)
+
+@router.get("/history/sessions")
+async def session_history(start: datetime.datetime, end: datetime.datetime, machine_id: Optional[int] = None,
+                          operator_id: Optional[int] = None, job_card_id: Optional[int] = None, db=Depends(get_read_db)):
+    """Sessions started in [start, end), archived or not, as NDJSON."""
+    start, end = as_utc(start), as_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    async def lines():
+        async for rec in archive.history(db, start, end, machine_id, operator_id, job_card_id):
+            yield json.dumps(rec) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pydantic import BaseModel
-from app.db.session import AsyncSessionLocal
-from app.db.models import Job, Drawing, JobCard
+from app.db.deps import get_db, DBRoute
+from app.db.models import Job, Drawing, JobCard, JobCardProgress
 from app.services.qr import build_qr_payload
-from app.services.pdfgen import generate_job_card_pdf
-from fastapi.responses import StreamingResponse
-from io import BytesIO
+from app.services.pdfgen import render_job_cards
+from app.services import refdata, idempotency, sketch, pdfcache
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy import select
+from types import SimpleNamespace
+from typing import List, Optional
+from app.core.config import settings
+import asyncio, os, tempfile
 
-router = APIRouter()
+router = APIRouter(route_class=DBRoute)
 
 class JobIn(BaseModel):
     name: str
@@ -24,48 +28,141 @@ class JobCardIn(BaseModel):
     drawing_id: int
     card_number: str
 
-async def get_db():
-    async with AsyncSessionLocal() as s:
-        yield s
+class PrintIn(BaseModel):
+    ids: Optional[List[int]] = None
+    drawing_id: Optional[int] = None
+    job_id: Optional[int] = None
+    unfinished: bool = False
 
 @router.post("/jobs")
-async def create_job(j: JobIn, db=Depends(get_db)):
+async def create_job(j: JobIn, db=Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    if idempotency_key:
+        replay = await idempotency.claim(db, "jobs", idempotency_key, j.model_dump())
+        if replay:
+            return replay
     job = Job(name=j.name, customer=j.customer)
     db.add(job)
-    await db.commit()
-    await db.refresh(job)
-    return {"id": job.id}
+    await db.flush()
+    res = {"id": job.id}
+    if idempotency_key:
+        await idempotency.store(db, "jobs", idempotency_key, res)
+    return res
 
 @router.post("/drawings")
-async def create_drawing(d: DrawingIn, db=Depends(get_db)):
+async def create_drawing(d: DrawingIn, db=Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    if idempotency_key:
+        replay = await idempotency.claim(db, "drawings", idempotency_key, d.model_dump())
+        if replay:
+            return replay
     dr = Drawing(job_id=d.job_id, drawing_number=d.drawing_number, planned_time_per_piece=d.planned_time_per_piece, planned_pieces=d.planned_pieces)
     db.add(dr)
-    await db.commit()
-    await db.refresh(dr)
-    return {"id": dr.id}
+    await db.flush()
+    res = {"id": dr.id}
+    if idempotency_key:
+        await idempotency.store(db, "drawings", idempotency_key, res)
+    return res
 
 @router.post("/jobcards")
-async def create_jobcard(jc: JobCardIn, db=Depends(get_db)):
+async def create_jobcard(jc: JobCardIn, db=Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    if idempotency_key:
+        replay = await idempotency.claim(db, "jobcards", idempotency_key, jc.model_dump())
+        if replay:
+            return replay
+    dr = await db.get(Drawing, jc.drawing_id)
+    if not dr:
+        raise HTTPException(404, "Drawing not found")
     jc_obj = JobCard(drawing_id=jc.drawing_id, card_number=jc.card_number)
     db.add(jc_obj)
-    await db.commit()
-    await db.refresh(jc_obj)
+    await db.flush()
     # build and save qr payload
-    qr = build_qr_payload(jc_obj.id)
-    jc_obj.qr_payload = qr
-    db.add(jc_obj)
-    await db.commit()
-    await db.refresh(jc_obj)
-    return {"id": jc_obj.id, "qr_payload": jc_obj.qr_payload}
+    jc_obj.qr_payload = build_qr_payload(jc_obj.id)
+    db.add(JobCardProgress(job_card_id=jc_obj.id, done=0, planned=dr.planned_pieces or 1))
+    res = {"id": jc_obj.id, "qr_payload": jc_obj.qr_payload}
+    if idempotency_key:
+        await idempotency.store(db, "jobcards", idempotency_key, res)
+    return res
 
 @router.get("/jobcard/{id}/pdf")
-async def jobcard_pdf(id: int, db=Depends(get_db)):
-    q = await db.execute(select(JobCard).where(JobCard.id==id))
-    jc = q.scalar_one_or_none()
+async def jobcard_pdf(id: int, db=Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    jc = await refdata.get_job_card(db, id)
     if not jc:
         raise HTTPException(404, "Not found")
-    # get drawing
-    q2 = await db.execute(select(Drawing).where(Drawing.id==jc.drawing_id))
-    dr = q2.scalar_one()
-    content = generate_job_card_pdf(jc, dr)
-    return StreamingResponse(BytesIO(content), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=jobcard_{id}.pdf"})
+    dr = await refdata.get_drawing(db, jc["drawing_id"]) if jc["drawing_id"] is not None else None
+    if not dr:
+        raise HTTPException(404, "Drawing not found")
+    jc, dr = SimpleNamespace(**jc), SimpleNamespace(**dr)
+    etag = f'"{pdfcache.key(jc, dr)}"'
+    # no-cache: clients revalidate every time, which costs a 304 and no rendering
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    # served from an open handle: the cache may evict the file meanwhile
+    f = await asyncio.to_thread(pdfcache.open_pdf, jc, dr)
+    headers.update({"Content-Length": str(os.fstat(f.fileno()).st_size),
+                    "Content-Disposition": f'attachment; filename="jobcard_{id}.pdf"'})
+
+    def chunks():
+        with f:
+            while data := f.read(1 << 16):
+                yield data
+    return StreamingResponse(chunks(), media_type="application/pdf", headers=headers)
+
+@router.get("/jobcards/{id}/progress")
+async def jobcard_progress(id: int, machine_id: Optional[int] = None, db=Depends(get_db)):
+    """Done/planned pieces and the ETA from the drawing's median piece time,
+    all machines merged unless machine_id is given."""
+    res = await sketch.progress(db, job_card_id=id, machine_id=machine_id)
+    if res is None:
+        raise HTTPException(404, "Not found")
+    return {"job_card_id": id, **res}
+
+@router.get("/drawings/{id}/progress")
+async def drawing_progress(id: int, machine_id: Optional[int] = None, db=Depends(get_db)):
+    """The same over every job card of the drawing."""
+    res = await sketch.progress(db, drawing_id=id, machine_id=machine_id)
+    if res is None:
+        raise HTTPException(404, "Not found")
+    return res
+
+def _print_query(p: PrintIn):
+    stmt = (select(JobCard.id, JobCard.card_number, JobCard.qr_payload, Drawing.drawing_number,
+                   Drawing.job_id, Drawing.planned_pieces, Drawing.planned_time_per_piece)
+            .join(Drawing, Drawing.id == JobCard.drawing_id)
+            .order_by(JobCard.id))
+    if p.ids is not None:
+        stmt = stmt.where(JobCard.id.in_(p.ids))
+    if p.drawing_id is not None:
+        stmt = stmt.where(JobCard.drawing_id == p.drawing_id)
+    if p.job_id is not None:
+        stmt = stmt.where(Drawing.job_id == p.job_id)
+    if p.unfinished:
+        stmt = stmt.outerjoin(JobCardProgress, JobCardProgress.job_card_id == JobCard.id).where(
+            (JobCardProgress.done == None) | (JobCardProgress.done < JobCardProgress.planned))
+    return stmt.limit(settings.PRINT_MAX_CARDS + 1)
+
+def _render(rows):
+    out = tempfile.SpooledTemporaryFile(max_size=8 << 20)
+    render_job_cards(((r, r) for r in rows), out)
+    out.seek(0)
+    return out
+
+@router.post("/jobcards/print")
+async def print_jobcards(p: PrintIn, db=Depends(get_db)):
+    """One PDF with a page per job card, by ids and/or drawing/job, in card id order."""
+    if p.ids is None and p.drawing_id is None and p.job_id is None:
+        raise HTTPException(400, "Give ids, drawing_id or job_id")
+    rows = (await db.execute(_print_query(p))).all()
+    if not rows:
+        raise HTTPException(404, "No job cards match")
+    if len(rows) > settings.PRINT_MAX_CARDS:
+        raise HTTPException(400, f"At most {settings.PRINT_MAX_CARDS} cards per print run")
+    # reportlab writes the xref table at save(), so the document is rendered
+    # whole, off the event loop, into a spooled file that is then streamed
+    out = await asyncio.to_thread(_render, rows)
+
+    def chunks():
+        with out:
+            while data := out.read(1 << 16):
+                yield data
+    return StreamingResponse(chunks(), media_type="application/pdf",
+                             headers={"Content-Disposition": f"attachment; filename=jobcards_{len(rows)}.pdf"})
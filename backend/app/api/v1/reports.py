@@ -0,0 +1,81 @@
+import datetime, zoneinfo
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.core.config import settings
+from app.db.deps import get_read_db, DBRoute
+from app.services import reports, rollups, utilization
+from app.services.listing import as_utc
+
+router = APIRouter(route_class=DBRoute)
+
+def parse_range(start: Optional[datetime.datetime], end: Optional[datetime.datetime]):
+    end = as_utc(end) if end else datetime.datetime.now(datetime.timezone.utc)
+    start = as_utc(start) if start else end - datetime.timedelta(days=30)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > datetime.timedelta(days=settings.REPORT_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"range is limited to {settings.REPORT_MAX_DAYS} days")
+    return start, end
+
+def parse_group_by(group_by: List[str]):
+    # accepts ?group_by=drawing&group_by=day as well as ?group_by=drawing,day
+    dims = [d for item in group_by for d in item.split(",") if d]
+    unknown = [d for d in dims if d not in reports.DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown group_by {', '.join(unknown)}; use {', '.join(reports.DIMENSIONS)}")
+    if not dims:
+        raise HTTPException(status_code=400, detail="group_by needs at least one dimension")
+    return list(dict.fromkeys(dims))
+
+def parse_tz(tz: str):
+    try:
+        zoneinfo.ZoneInfo(tz)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"unknown time zone {tz}")
+    return tz
+
+@router.get("/reports/efficiency")
+async def efficiency(start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                     group_by: List[str] = Query(["drawing"]), tz: str = settings.REPORT_TIMEZONE,
+                     drawing_id: Optional[int] = None, job_id: Optional[int] = None,
+                     operator_id: Optional[int] = None, machine_id: Optional[int] = None,
+                     db=Depends(get_read_db)):
+    """Actual vs planned seconds per piece over stopped sessions started in [start, end)."""
+    start, end = parse_range(start, end)
+    dims = parse_group_by(group_by)
+    tz = parse_tz(tz)
+    filters = {"drawing_id": drawing_id, "job_id": job_id, "operator_id": operator_id, "machine_id": machine_id}
+    rows = await reports.efficiency(db, start, end, dims, tz, filters)
+    return {"start": start, "end": end, "group_by": dims, "rows": rows}
+
+@router.get("/reports/utilization")
+async def machine_utilization(start: Optional[datetime.datetime] = Query(None, alias="from"),
+                              end: Optional[datetime.datetime] = Query(None, alias="to"),
+                              bucket: str = Query("shift", pattern=f"^({'|'.join(utilization.BUCKETS)})$"),
+                              tz: str = settings.REPORT_TIMEZONE, machine_id: Optional[int] = None,
+                              db=Depends(get_read_db)):
+    """Busy time and busy ratio per machine and bucket in [from, to); overlapping sessions count once."""
+    start, end = parse_range(start, end)
+    tz = parse_tz(tz)
+    machines = await utilization.utilization(db, start, end, bucket, tz, machine_id)
+    return {"from": start, "to": end, "bucket": bucket,
+            "machines": [{"machine_id": m, "buckets": b} for m, b in machines.items()]}
+
+@router.get("/reports/oee/machines")
+async def machine_oee(start: Optional[datetime.datetime] = Query(None, alias="from"),
+                      end: Optional[datetime.datetime] = Query(None, alias="to"),
+                      bucket: str = Query("hour", pattern="^(hour|day)$"), tz: str = settings.REPORT_TIMEZONE,
+                      machine_id: Optional[int] = None, db=Depends(get_read_db)):
+    """Pieces, busy/run/planned seconds, availability and performance per machine, from the hourly rollup."""
+    start, end = parse_range(start, end)
+    rows = await rollups.machine_stats(db, start, end, bucket, parse_tz(tz), machine_id)
+    return {"from": start, "to": end, "bucket": bucket, "rows": rows}
+
+@router.get("/reports/oee/operators")
+async def operator_oee(start: Optional[datetime.datetime] = Query(None, alias="from"),
+                       end: Optional[datetime.datetime] = Query(None, alias="to"),
+                       operator_id: Optional[int] = None, db=Depends(get_read_db)):
+    """The same per operator and day; days are REPORT_TIMEZONE days."""
+    start, end = parse_range(start, end)
+    rows = await rollups.operator_stats(db, start, end, settings.REPORT_TIMEZONE, operator_id)
+    return {"from": start, "to": end, "bucket": "day", "rows": rows}
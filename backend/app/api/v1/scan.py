@@ -1,63 +1,177 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from pydantic import BaseModel
-from app.db.session import AsyncSessionLocal
+from typing import List, Optional
+from app.core.config import settings
+from app.core.metrics import SCANS
+from app.db.deps import get_db, DBRoute, after_commit
 from app.services.qr import verify_qr_payload
-from app.db.models import Session as DBSession, SessionStatus, JobCard, Drawing
-from sqlalchemy import select, func
-import datetime
-from app.services import notifier
+from app.services.scanning import toggle_session, replay_scans
+from app.services import notifier, refdata, events, idempotency
 import asyncio
+import datetime
+from collections import Counter
 
-router = APIRouter()
+router = APIRouter(route_class=DBRoute)
 
 class ScanIn(BaseModel):
     operator_id: int
     machine_id: int
     qr_payload: str
 
-async def get_db():
-    async with AsyncSessionLocal() as s:
-        yield s
+class BatchScanIn(BaseModel):
+    operator_id: int
+    machine_id: int
+    qr_payload: str
+    ts: datetime.datetime
+    # the key the scan was first sent to /scan with, if that answer was lost
+    idempotency_key: Optional[str] = None
+
+class BatchIn(BaseModel):
+    scans: List[BatchScanIn]
+
+async def _unknown_refs(db, job_card_id, machine_id, operator_id):
+    # cached lookups, so unknown ids give a 404 instead of an FK violation
+    if await refdata.get_job_card(db, job_card_id) is None:
+        return "job card"
+    if await refdata.get_machine(db, machine_id) is None:
+        return "machine"
+    if await refdata.get_user(db, operator_id) is None:
+        return "operator"
+    return None
+
+def _scan_out(res):
+    # the /scan answer, also stored for applied batch items sent with their own key
+    if res["action"] == "started":
+        ts = res["start_ts"]
+        return {"action": "started", "session_id": res["session_id"], "start_ts": ts if isinstance(ts, str) else ts.isoformat()}
+    return {"action": "stopped", "session_id": res["session_id"], "duration_seconds": res["duration_seconds"], "done": res["done"], "planned": res["planned"]}
+
+def _scan_event(res, job_card_id, machine_id, operator_id):
+    ev = {"type": "session_" + res["action"], "session_id": res["session_id"],
+          "job_card_id": job_card_id, "machine_id": machine_id, "operator_id": operator_id}
+    if res["action"] == "started":
+        ev["start_ts"] = res["start_ts"]
+    else:
+        ev.update(duration_seconds=res["duration_seconds"], done=res["done"], planned=res["planned"])
+    return ev
 
 @router.post("/scan")
-async def scan(payload: ScanIn, db=Depends(get_db)):
+async def scan(payload: ScanIn, db=Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    if idempotency_key:
+        # a retried scan replays the first answer instead of toggling again
+        replay = await idempotency.claim(db, "scan", idempotency_key, payload.model_dump())
+        if replay:
+            return replay
     vf = verify_qr_payload(payload.qr_payload)
     if not vf:
+        SCANS.labels("invalid_qr").inc()
         raise HTTPException(400, "Invalid QR payload")
     job_card_id = vf["job_card_id"]
-    now = datetime.datetime.utcnow()
-
-    q = select(DBSession).where(
-        DBSession.job_card_id==job_card_id,
-        DBSession.machine_id==payload.machine_id,
-        DBSession.operator_id==payload.operator_id,
-        DBSession.status==SessionStatus.started
-    ).order_by(DBSession.start_ts.desc()).limit(1)
-    res = await db.execute(q)
-    existing = res.scalar_one_or_none()
-    if existing is None:
-        # START
-        new = DBSession(job_card_id=job_card_id, operator_id=payload.operator_id,
-                        machine_id=payload.machine_id, start_ts=now, status=SessionStatus.started)
-        db.add(new)
-        await db.commit()
-        await db.refresh(new)
-        return {"action": "started", "session_id": new.id, "start_ts": new.start_ts.isoformat()}
-    else:
-        # STOP
-        existing.stop_ts = now
-        existing.duration_seconds = int((existing.stop_ts - existing.start_ts).total_seconds())
-        existing.status = SessionStatus.stopped
-        db.add(existing)
-        await db.commit()
-        # check if jobcard done
-        q2 = select(Drawing.planned_pieces).join(JobCard, JobCard.drawing_id==Drawing.id).where(JobCard.id==job_card_id)
-        r2 = await db.execute(q2)
-        planned = r2.scalar_one_or_none() or 1
-        q3 = select(func.count(DBSession.id)).where(DBSession.job_card_id==job_card_id, DBSession.status==SessionStatus.stopped)
-        r3 = await db.execute(q3)
-        done = r3.scalar_one()
-        if done >= planned:
+    unknown = await _unknown_refs(db, job_card_id, payload.machine_id, payload.operator_id)
+    if unknown:
+        raise HTTPException(404, f"Unknown {unknown}")
+
+    # START or STOP in one atomic statement
+    res = await toggle_session(db, job_card_id, payload.operator_id, payload.machine_id)
+    if res is None:
+        SCANS.labels("duplicate").inc()
+        # duplicate start from a concurrent scan of the same card
+        raise HTTPException(409, "Scan already in progress")
+    out = _scan_out(res)
+    if idempotency_key:
+        await idempotency.store(db, "scan", idempotency_key, out)
+
+    def committed():
+        SCANS.labels(res["action"]).inc()
+        evs = [_scan_event(res, job_card_id, payload.machine_id, payload.operator_id)]
+        if res["action"] == "stopped" and res["done"] >= res["planned"]:
+            done, planned = res["done"], res["planned"]
+            SCANS.labels("card_completed").inc()
             # fire off notification async
             asyncio.create_task(notifier.send_telegram(f"JobCard {job_card_id} completed: {done}/{planned}"))
-        return {"action": "stopped", "session_id": existing.id, "duration_seconds": existing.duration_seconds, "done": done, "planned": planned}
+            evs.append({"type": "card_completed", "job_card_id": job_card_id, "done": done, "planned": planned})
+        events.publish(*evs)
+    after_commit(db, committed)
+    return out
+
+@router.post("/scan/batch")
+async def scan_batch(payload: BatchIn, db=Depends(get_db), idempotency_key: Optional[str] = Header(None)):
+    if len(payload.scans) > settings.SCAN_BATCH_MAX_ITEMS:
+        raise HTTPException(413, f"At most {settings.SCAN_BATCH_MAX_ITEMS} scans per batch")
+    if idempotency_key:
+        replay = await idempotency.claim(db, "scan_batch", idempotency_key, payload.model_dump())
+        if replay:
+            return replay
+    # verify every distinct token once
+    verified = {t: verify_qr_payload(t) for t in {s.qr_payload for s in payload.scans}}
+    results = [None] * len(payload.scans)
+    # a queued scan /scan may already have applied: replay its answer instead of toggling again
+    keyed, owned = {}, {}
+    for i, s in enumerate(payload.scans):
+        if s.idempotency_key is None:
+            continue
+        if s.idempotency_key in keyed:
+            results[i] = {"index": i, "action": "error", "detail": "Duplicate Idempotency-Key in batch"}
+        else:
+            keyed[s.idempotency_key] = s.model_dump(include={"operator_id", "machine_id", "qr_payload"})
+            owned[s.idempotency_key] = i
+    replays, key_errors = await idempotency.claim_many(db, "scan", keyed)
+    valid, positions, checked = [], [], {}
+    for i, s in enumerate(payload.scans):
+        if results[i] is not None:
+            continue
+        if s.idempotency_key in replays:
+            results[i] = {"index": i, **replays[s.idempotency_key], "replayed": True}
+            del owned[s.idempotency_key]
+            continue
+        if s.idempotency_key in key_errors:
+            results[i] = {"index": i, "action": "error", "detail": key_errors[s.idempotency_key]}
+            del owned[s.idempotency_key]
+            continue
+        vf = verified[s.qr_payload]
+        if not vf:
+            SCANS.labels("invalid_qr").inc()
+            results[i] = {"index": i, "action": "error", "detail": "Invalid QR payload"}
+            continue
+        refs = (vf["job_card_id"], s.machine_id, s.operator_id)
+        if refs not in checked:
+            checked[refs] = await _unknown_refs(db, *refs)
+        if checked[refs]:
+            results[i] = {"index": i, "action": "error", "detail": f"Unknown {checked[refs]}"}
+            continue
+        ts = s.ts if s.ts.tzinfo else s.ts.replace(tzinfo=datetime.timezone.utc)
+        valid.append({"job_card_id": vf["job_card_id"], "operator_id": s.operator_id, "machine_id": s.machine_id, "ts": ts})
+        positions.append(i)
+
+    replayed = await replay_scans(db, valid)
+
+    stops, progress, evs = Counter(), {}, []
+    for i, item, r in zip(positions, valid, replayed):
+        results[i] = {"index": i, **r}
+        if r["action"] == "skipped":
+            continue
+        if r["action"] == "stopped":
+            stops[r["job_card_id"]] += 1
+            progress[r["job_card_id"]] = (r["done"], r["planned"])
+        evs.append(_scan_event(r, r["job_card_id"], item["machine_id"], item["operator_id"]))
+    # answer the keys whose scan was applied, so a retry of the original /scan
+    # replays instead of toggling; the others store nothing, like a failed /scan
+    applied = {k: i for k, i in owned.items() if results[i]["action"] in ("started", "stopped")}
+    await idempotency.store_many(db, "scan", {k: _scan_out(results[i]) for k, i in applied.items()})
+    await idempotency.release_many(db, "scan", [k for k in owned if k not in applied])
+    out = {"results": results}
+    if idempotency_key:
+        await idempotency.store(db, "scan_batch", idempotency_key, out)
+
+    def committed():
+        for r in replayed:
+            SCANS.labels("duplicate" if r["action"] == "skipped" else r["action"]).inc()
+        for job_card_id, (done, planned) in progress.items():
+            # only cards that crossed the line within this batch
+            if done >= planned > done - stops[job_card_id]:
+                asyncio.create_task(notifier.send_telegram(f"JobCard {job_card_id} completed: {done}/{planned}"))
+                SCANS.labels("card_completed").inc()
+                evs.append({"type": "card_completed", "job_card_id": job_card_id, "done": done, "planned": planned})
+        events.publish(*evs)
+    after_commit(db, committed)
+    return out
@@ -2,9 +2,27 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "postgresql+asyncpg://cnc:cncpass@db:5432/cnc"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PGBOUNCER: bool = False
+    DB_SLOW_CHECKOUT_MS: float = 100
+    DB_STARTUP_MODE: str = "check"
+    DATABASE_READ_URL: str = ""
+    DB_READ_MAX_LAG_SECONDS: float = 10
+    DB_READ_LAG_CHECK_SECONDS: float = 5
+    DB_READ_LAG_CHECK_TIMEOUT: float = 1
     SECRET_KEY: str = "replace-me-with-secure-secret"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60*24
     QR_SECRET: str = "qr-secret-change"
+    QR_CACHE_SIZE: int = 4096
+    QR_NEGATIVE_TTL_SECONDS: float = 30
+    PRINT_MAX_CARDS: int = 1000
+    PDF_CACHE_DIR: str = "/data/pdfcache"
+    PDF_CACHE_MAX_MB: int = 256
     TELEGRAM_BOT_TOKEN: str = ""
     TELEGRAM_CHAT_ID: str = ""
     SMTP_HOST: str = ""
@@ -12,6 +30,30 @@ class Settings(BaseSettings):
     SMTP_USER: str = ""
     SMTP_PASS: str = ""
     FRONTEND_URL: str = "http://localhost:5173"
+    REDIS_URL: str = ""
+    REDIS_TIMEOUT_SECONDS: float = 0.5
+    REFDATA_CACHE_SIZE: int = 10000
+    REFDATA_TTL_SECONDS: float = 30
+    REFDATA_REDIS_TTL_SECONDS: int = 3600
+    EVENTS_BUFFER_SIZE: int = 256
+    IDEMPOTENCY_TTL_SECONDS: int = 60*60*24
+    EVENTS_KEEPALIVE_SECONDS: float = 15
+    SCAN_BATCH_MAX_ITEMS: int = 1000
+    SESSIONS_PARTITIONS_AHEAD: int = 3
+    SESSIONS_RETENTION_MONTHS: int = 24
+    SESSIONS_OPEN_LOOKBACK_DAYS: int = 62
+    SESSION_STALE_MODE: str = "cancel"
+    SESSION_STALE_FACTOR: float = 4
+    SESSION_STALE_MIN_SECONDS: int = 30*60
+    SESSION_STALE_DEFAULT_SECONDS: int = 8*3600
+    SESSION_STALE_BATCH: int = 1000
+    REPORT_TIMEZONE: str = "Europe/Prague"
+    REPORT_MAX_DAYS: int = 400
+    SHIFT_STARTS: str = "06:00,14:00,22:00"
+    ROLLUP_BATCH_SIZE: int = 5000
+    ROLLUP_LAG_SECONDS: float = 60
+    ARCHIVE_DIR: str = "/data/archive"
+    ARCHIVE_AFTER_MONTHS: int = 12
 
     class Config:
         env_file = "/app/.env"
@@ -0,0 +1,102 @@
+"""Prometheus instrumentation.
+
+With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty,
+writable directory shared by the workers; every process then writes its
+samples there and /metrics aggregates them. Without it the metrics of the
+serving process are exported.
+"""
+import os, time
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from starlette.responses import Response
+
+MULTIPROC = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ["method"], multiprocess_mode="livesum")
+
+SCANS = Counter("scan_events_total", "Scan outcomes", ["event"])
+
+# pool: "primary" or "replica"
+POOL_SIZE = Gauge("db_pool_size", "Configured pool size", ["pool"], multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use", ["pool"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections above pool size", ["pool"], multiprocess_mode="livesum")
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements issued per request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50),
+)
+REPLICA_LAG = Gauge("db_replica_lag_seconds", "Read replica replay lag at the last check", multiprocess_mode="max")
+READ_FALLBACKS = Counter("db_read_fallbacks_total", "Read-only requests served by the primary because the replica was unusable")
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight requests per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        IN_PROGRESS.labels(method).inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # route template, set by the router; keeps label cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            LATENCY.labels(method, path).observe(time.perf_counter() - t0)
+            REQUESTS.labels(method, path, str(status[0])).inc()
+            IN_PROGRESS.labels(method).dec()
+
+
+def instrument_pool(engine):
+    pool = engine.sync_engine.pool
+
+    # checkin fires before the pool takes the connection back, so count
+    # checkouts by hand instead of reading pool.checkedout() there
+    name = getattr(pool, "name", "primary")
+
+    def on_checkout(*args):
+        POOL_CHECKED_OUT.labels(name).inc()
+        POOL_OVERFLOW.labels(name).set(max(0, pool.overflow()))
+
+    def on_checkin(*args):
+        POOL_CHECKED_OUT.labels(name).dec()
+
+    POOL_SIZE.labels(name).set(pool.size())
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+
+
+def metrics_response():
+    if MULTIPROC:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    if MULTIPROC:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,87 @@
+"""Request-scoped database session shared by all routers.
+
+``get_db`` hands out an AsyncSession, which only checks a connection out of
+the pool on its first query, so requests that fail validation or never touch
+the database cost no connection. ``get_read_db`` does the same on the read
+replica when one is configured and not lagging (see app.db.session).
+Routers built with ``DBRoute`` commit that session once after the endpoint
+returns (before the response is sent), roll it back if the endpoint raises,
+run callbacks registered with ``after_commit`` and count the queries the
+request issued.
+"""
+import contextvars, inspect
+from fastapi import Request
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from app.core.metrics import DB_QUERIES
+from app.db.session import AsyncSessionLocal, engine, read_engine, read_session
+
+_query_count = contextvars.ContextVar("db_query_count", default=None)
+
+
+def _count_query(*args):
+    box = _query_count.get()
+    if box is not None:
+        box[0] += 1
+
+
+for _engine in (engine, read_engine):
+    if _engine is not None:
+        event.listen(_engine.sync_engine, "before_cursor_execute", _count_query)
+
+
+async def get_db(request: Request):
+    session = AsyncSessionLocal()
+    request.state.db = session
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+async def get_read_db(request: Request):
+    """Like get_db, but on the read replica while it keeps up. Only for
+    endpoints that never write."""
+    session = await read_session()
+    request.state.db = session
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
+def after_commit(db, fn):
+    """Run ``fn`` (sync or async) once the request's transaction has committed."""
+    db.info.setdefault("after_commit", []).append(fn)
+
+
+class DBRoute(APIRoute):
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        path = self.path
+
+        async def route_handler(request: Request):
+            box = [0]
+            _query_count.set(box)
+            try:
+                response = await handler(request)
+                db = getattr(request.state, "db", None)
+                if db is not None:
+                    if db.in_transaction():
+                        await db.commit()
+                    for fn in db.info.pop("after_commit", []):
+                        res = fn()
+                        if inspect.isawaitable(res):
+                            await res
+            except Exception:
+                db = getattr(request.state, "db", None)
+                if db is not None:
+                    db.info.pop("after_commit", None)
+                    await db.rollback()
+                raise
+            finally:
+                DB_QUERIES.labels(path).observe(box[0])
+            response.headers["X-DB-Queries"] = str(box[0])
+            return response
+
+        return route_handler
@@ -0,0 +1,113 @@
+"""Schema setup at startup and as a release step.
+
+``python -m app.db.migrate`` upgrades to the Alembic head while holding a
+Postgres advisory lock, so any number of processes can run it and only the
+first one does the work. App processes then only compare alembic_version
+with the head of the migration scripts (DB_STARTUP_MODE=check).
+"""
+import asyncio, logging, time
+from pathlib import Path
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+from app.core.config import settings
+from app.db.base import Base
+from app.db.session import engine
+from app.services import partitions
+
+log = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parents[1] / "alembic.ini"
+_LOCK_KEY = 0x41E3B1C
+
+
+def alembic_config(connection=None):
+    cfg = Config(str(ALEMBIC_INI))
+    cfg.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    if connection is not None:
+        cfg.attributes["connection"] = connection
+    return cfg
+
+
+def head_revision():
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def sync_url():
+    # alembic runs on a blocking connection; same database, psycopg2 driver
+    return make_url(settings.DATABASE_URL).set(drivername="postgresql+psycopg2")
+
+
+def upgrade():
+    """Upgrade to head under a session advisory lock; waits while another
+    process holds it and then finds nothing left to do."""
+    eng = create_engine(sync_url(), poolclass=NullPool)
+    try:
+        # the lock lives on its own autocommit connection and waiters poll:
+        # a session blocked in pg_advisory_lock() holds a snapshot, which
+        # CREATE INDEX CONCURRENTLY in the running migration would wait on
+        with eng.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+            while not lock.scalar(text("SELECT pg_try_advisory_lock(:k)"), {"k": _LOCK_KEY}):
+                time.sleep(0.5)
+            try:
+                with eng.connect() as conn:
+                    command.upgrade(alembic_config(conn), "head")
+                    conn.commit()
+            finally:
+                lock.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _LOCK_KEY})
+    finally:
+        eng.dispose()
+
+
+async def current_revision():
+    async with engine.connect() as conn:
+        try:
+            return await conn.scalar(text("SELECT version_num FROM alembic_version"))
+        except DBAPIError:
+            return None
+
+
+async def check():
+    head, current = head_revision(), await current_revision()
+    if current != head:
+        raise RuntimeError(
+            f"database schema is at {current}, the code expects {head}; run `python -m app.db.migrate`"
+        )
+
+
+async def migrate():
+    await asyncio.to_thread(upgrade)
+    async with engine.begin() as conn:
+        await partitions.ensure_partitions(conn, settings.SESSIONS_PARTITIONS_AHEAD)
+
+
+async def create_all():
+    # dev only: no alembic history, racy with several workers
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await partitions.ensure_partitions(conn, settings.SESSIONS_PARTITIONS_AHEAD)
+
+
+STARTUP_MODES = {"check": check, "migrate": migrate, "create_all": create_all}
+
+
+async def prepare(mode):
+    if mode == "off":
+        return
+    if mode not in STARTUP_MODES:
+        raise RuntimeError(f"unknown DB_STARTUP_MODE {mode!r}; use one of {', '.join(STARTUP_MODES)} or off")
+    await STARTUP_MODES[mode]()
+
+
+async def _main():
+    await migrate()
+    await engine.dispose()
+    log.info("database at %s", head_revision())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, JSON, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, ForeignKey, JSON, Index, text
 from sqlalchemy.sql import func
 import enum
 from app.db.base import Base
@@ -21,12 +21,17 @@ class Machine(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
 
+    # keyset pagination by name (migration 0007)
+    __table_args__ = (Index('ix_machines_name_id', name, id),)
+
 class Job(Base):
     __tablename__ = "jobs"
     id = Column(Integer, primary_key=True)
     name = Column(String)
     customer = Column(String)
 
+    __table_args__ = (Index('ix_jobs_name_id', func.coalesce(name, ''), id),)
+
 class Drawing(Base):
     __tablename__ = "drawings"
     id = Column(Integer, primary_key=True)
@@ -46,23 +51,94 @@ class JobCard(Base):
 
     drawing = relationship("Drawing")
 
+class JobCardProgress(Base):
+    """Per-card counters, bumped in the same statement that stops a session."""
+    __tablename__ = "job_card_progress"
+    job_card_id = Column(Integer, ForeignKey("job_cards.id"), primary_key=True)
+    done = Column(Integer, nullable=False, default=0, server_default="0")
+    planned = Column(Integer, nullable=False, default=1, server_default="1")
+    total_seconds = Column(BigInteger, nullable=False, default=0, server_default="0")
+    first_start = Column(DateTime(timezone=True), nullable=True)
+    last_stop = Column(DateTime(timezone=True), nullable=True)
+
+class DurationSketch(Base):
+    """Piece-time histogram bucket of a drawing on a machine (app.services.sketch)."""
+    __tablename__ = "duration_sketches"
+    drawing_id = Column(Integer, ForeignKey("drawings.id"), primary_key=True)
+    machine_id = Column(Integer, ForeignKey("machines.id"), primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    n = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+class IdempotencyKey(Base):
+    """Stored response for a client-supplied Idempotency-Key."""
+    __tablename__ = "idempotency_keys"
+    scope = Column(String(64), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
 class Session(Base):
+    """One piece on one machine; range-partitioned by start_ts, one partition
+    per month (see app.services.partitions)."""
     __tablename__ = "sessions"
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     job_card_id = Column(Integer, ForeignKey("job_cards.id"))
     operator_id = Column(Integer, ForeignKey("users.id"))
     machine_id = Column(Integer, ForeignKey("machines.id"))
     piece_index = Column(Integer, default=1)
-    start_ts = Column(DateTime(timezone=True), server_default=func.now())
+    start_ts = Column(DateTime(timezone=True), primary_key=True, nullable=False, server_default=func.now())
     stop_ts = Column(DateTime(timezone=True), nullable=True)
     duration_seconds = Column(Integer, nullable=True)
-    status = Column(Enum(SessionStatus), default=SessionStatus.started)
+    # plain VARCHAR as the migrations create it; values are SessionStatus's
+    status = Column(String, default=SessionStatus.started.value)
     meta = Column(JSON, nullable=True)
+    # bumped by every stop; the rollup worker's watermark
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
     job_card = relationship("JobCard")
     operator = relationship("User")
     machine = relationship("Machine")
 
+    # the partition key has to be part of the primary key; id alone still
+    # identifies a row for the ORM
+    __mapper_args__ = {"primary_key": [id]}
     __table_args__ = (
-        UniqueConstraint('job_card_id', 'piece_index', 'machine_id', 'operator_id', name='uniq_piece_owner'),
+        # uniq_piece_owner cannot span partitions, so each partition carries
+        # its own unique index (see app.services.partitions)
+        Index('ix_sessions_open', job_card_id, machine_id, operator_id, start_ts.desc(),
+              postgresql_where=text("status = 'started'"), postgresql_include=['id']),
+        Index('ix_sessions_stopped_updated', updated_at, id, postgresql_where=text("status = 'stopped'")),
+        Index('ix_sessions_start_ts', start_ts),
+        Index('ix_sessions_started_ts', start_ts, postgresql_where=text("status = 'started'")),
+        {"postgresql_partition_by": "RANGE (start_ts)"},
     )
+
+class MachineHourlyStats(Base):
+    """Rollup of stopped sessions per machine and UTC hour (app.services.rollups)."""
+    __tablename__ = "machine_hourly_stats"
+    machine_id = Column(Integer, ForeignKey("machines.id"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    pieces = Column(Integer, nullable=False, server_default="0")
+    busy_seconds = Column(Integer, nullable=False, server_default="0")
+    run_seconds = Column(BigInteger, nullable=False, server_default="0")
+    planned_seconds = Column(BigInteger, nullable=False, server_default="0")
+    first_start = Column(DateTime(timezone=True), nullable=True)
+
+class OperatorDailyStats(Base):
+    """Rollup of stopped sessions per operator and local day (REPORT_TIMEZONE)."""
+    __tablename__ = "operator_daily_stats"
+    operator_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    pieces = Column(Integer, nullable=False, server_default="0")
+    busy_seconds = Column(Integer, nullable=False, server_default="0")
+    run_seconds = Column(BigInteger, nullable=False, server_default="0")
+    planned_seconds = Column(BigInteger, nullable=False, server_default="0")
+    first_start = Column(DateTime(timezone=True), nullable=True)
+
+class RollupWatermark(Base):
+    """Last (updated_at, id) of stopped sessions folded into the rollups."""
+    __tablename__ = "rollup_watermarks"
+    name = Column(String(64), primary_key=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    session_id = Column(Integer, nullable=False)
@@ -1,6 +1,155 @@
+import asyncio, contextlib, logging, time, uuid
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from app.core.config import settings
+from app.core.metrics import POOL_CHECKOUT_WAIT, REPLICA_LAG, READ_FALLBACKS
 
-engine = create_async_engine(settings.DATABASE_URL, future=True, echo=False)
+log = logging.getLogger(__name__)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection.
+    Counters are per pool; ``name`` labels its metrics."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.name = "primary"
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep its label
+        pool = super().recreate()
+        pool.name = self.name
+        return pool
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - t0
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            POOL_CHECKOUT_WAIT.labels(self.name).observe(waited)
+            if waited * 1000 >= settings.DB_SLOW_CHECKOUT_MS:
+                log.warning("db pool %s: waited %.0f ms for a connection (%s)", self.name, waited * 1000, self.status())
+
+
+def pool_stats(pool=None):
+    pool = pool or engine.sync_engine.pool
+    n = pool.checkouts
+    return {
+        "status": pool.status(),
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+        "checkouts": n,
+        "wait_avg_ms": round(pool.wait_total / n * 1000, 3) if n else None,
+        "wait_max_ms": round(pool.wait_max * 1000, 3),
+    }
+
+
+def _connect_args():
+    connect_args = {}
+    if settings.DB_PGBOUNCER:
+        # PgBouncer in transaction mode can't keep server-side prepared
+        # statements: disable both caches and use unique statement names
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+        )
+    else:
+        connect_args["prepared_statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+    return connect_args
+
+
+def _engine_kwargs():
+    return dict(
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=_connect_args(),
+    )
+
+
+engine = create_async_engine(settings.DATABASE_URL, future=True, echo=False, **_engine_kwargs())
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+@contextlib.asynccontextmanager
+async def task_engine():
+    """Unpooled engine for one asyncio.run() in a worker actor. asyncpg
+    connections belong to the loop that opened them, so nothing may outlive
+    the run; the engine is disposed on the way out, also on errors."""
+    eng = create_async_engine(settings.DATABASE_URL, future=True, echo=False,
+                              poolclass=NullPool, connect_args=_connect_args())
+    try:
+        yield eng
+    finally:
+        await eng.dispose()
+
+# Optional read replica for listings and reports. Writes and anything that
+# must see its own writes stay on ``engine``.
+read_engine = None
+AsyncReadSessionLocal = None
+if settings.DATABASE_READ_URL:
+    read_engine = create_async_engine(settings.DATABASE_READ_URL, future=True, echo=False, **_engine_kwargs())
+    read_engine.sync_engine.pool.name = "replica"
+    AsyncReadSessionLocal = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+# an idle primary sends no WAL, so only count replay delay while WAL is pending
+LAG_SQL = text("""
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+""")
+_replica = {"checked": 0.0, "ok": False, "lag": None}
+
+
+async def replica_ok():
+    """Whether reads may go to the replica: configured, reachable and no more
+    than DB_READ_MAX_LAG_SECONDS behind. Checked at most every
+    DB_READ_LAG_CHECK_SECONDS; callers arriving mid-check get the last answer."""
+    if read_engine is None:
+        return False
+    now = time.monotonic()
+    if now - _replica["checked"] < settings.DB_READ_LAG_CHECK_SECONDS:
+        return _replica["ok"]
+    _replica["checked"] = now
+    try:
+        async with read_engine.connect() as conn:
+            lag = float(await asyncio.wait_for(conn.scalar(LAG_SQL), settings.DB_READ_LAG_CHECK_TIMEOUT))
+    except Exception as e:
+        log.warning("db replica: check failed, reading from primary (%s)", e)
+        _replica.update(ok=False, lag=None)
+        return False
+    REPLICA_LAG.set(lag)
+    ok = lag <= settings.DB_READ_MAX_LAG_SECONDS
+    if not ok and _replica["ok"]:
+        log.warning("db replica: %.1f s behind, reading from primary", lag)
+    _replica.update(ok=ok, lag=lag)
+    return ok
+
+
+async def read_session():
+    """Session on the replica when it is usable, otherwise on the primary."""
+    if await replica_ok():
+        return AsyncReadSessionLocal()
+    if read_engine is not None:
+        READ_FALLBACKS.inc()
+    return AsyncSessionLocal()
+
+
+def replica_stats():
+    if read_engine is None:
+        return None
+    return {**pool_stats(read_engine.sync_engine.pool), "ok": _replica["ok"], "lag_seconds": _replica["lag"]}
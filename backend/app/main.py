@@ -1,17 +1,37 @@
 from fastapi import FastAPI
-from app.api.v1 import scan, jobs, auth
-from app.db.base import Base
-from app.db.session import engine
+from app.api.v1 import scan, jobs, auth, events, debug, history, admin_endpoints, reports, exports
+from app.db.session import engine, read_engine
+from app.db import migrate
+from app.core import metrics
+from app.core.config import settings
 import asyncio
 
 app = FastAPI(title="CNC Capture API")
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_pool(engine)
+if read_engine is not None:
+    metrics.instrument_pool(read_engine)
 
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(jobs.router, prefix="/api/v1", tags=["jobs"])
 app.include_router(scan.router, prefix="/api/v1", tags=["scan"])
+app.include_router(events.router, prefix="/api/v1", tags=["events"])
+app.include_router(admin_endpoints.router, prefix="/api/v1", tags=["admin"])
+app.include_router(reports.router, prefix="/api/v1", tags=["reports"])
+app.include_router(history.router, prefix="/api/v1", tags=["history"])
+app.include_router(exports.router, prefix="/api/v1", tags=["exports"])
+app.include_router(debug.router, prefix="/api/v1", tags=["debug"])
 
 @app.on_event("startup")
 async def startup():
-    # create tables automatically (dev); in prod use alembic
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # schema is owned by alembic (python -m app.db.migrate); by default only
+    # verify the head revision here, one cheap query per process
+    await migrate.prepare(settings.DB_STARTUP_MODE)
+
+@app.on_event("shutdown")
+async def shutdown():
+    metrics.mark_process_dead()
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return metrics.metrics_response()
@@ -0,0 +1,248 @@
+"""Cold archive of closed sessions as gzipped CSV, one directory per month.
+
+Each run writes ``<ARCHIVE_DIR>/sessions/month=YYYY-MM/part-<unix ts>.csv.gz``
+with a ``.sha256`` sidecar, denormalised with card, drawing, operator and
+machine names so the files stand on their own. Rows are only deleted from
+Postgres after the file has been read back and matched what was exported,
+and the file keeps a ``.tmp`` name until that delete has committed.
+``history`` answers range queries across both the archive and the database.
+"""
+import asyncio, csv, datetime, gzip, hashlib, io, logging, os, time
+from pathlib import Path
+from sqlalchemy import text
+from app.core.config import settings
+from app.services import partitions
+
+log = logging.getLogger(__name__)
+
+COLUMNS = [
+    "id", "job_card_id", "card_number", "drawing_id", "drawing_number",
+    "operator_id", "operator", "machine_id", "machine",
+    "piece_index", "start_ts", "stop_ts", "duration_seconds", "status",
+]
+_INTS = {"id", "job_card_id", "drawing_id", "operator_id", "machine_id", "piece_index", "duration_seconds"}
+
+SELECT_SQL = """
+SELECT s.id, s.job_card_id, jc.card_number, jc.drawing_id, d.drawing_number,
+       s.operator_id, u.username AS operator, s.machine_id, m.name AS machine,
+       s.piece_index, s.start_ts, s.stop_ts, s.duration_seconds, CAST(s.status AS text) AS status
+FROM {source} s
+LEFT JOIN job_cards jc ON jc.id = s.job_card_id
+LEFT JOIN drawings d ON d.id = jc.drawing_id
+LEFT JOIN users u ON u.id = s.operator_id
+LEFT JOIN machines m ON m.id = s.machine_id
+WHERE s.start_ts >= :lo AND s.start_ts < :hi {where}
+ORDER BY s.start_ts, s.id
+"""
+
+
+def _utc(month):
+    return datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def month_dir(month):
+    return Path(settings.ARCHIVE_DIR) / "sessions" / f"month={month:%Y-%m}"
+
+
+def archived_months():
+    root = Path(settings.ARCHIVE_DIR) / "sessions"
+    if not root.is_dir():
+        return []
+    return sorted(datetime.date.fromisoformat(p.name[6:] + "-01") for p in root.glob("month=*") if any(p.glob("*.csv.gz")))
+
+
+def _cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, datetime.datetime):
+        return v.isoformat()
+    return v
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def archive_month(conn, month, source=partitions.PARENT, closed_only=True):
+    """Export one month of ``source`` and delete the exported rows, in the
+    caller's transaction. Returns (tmp, rows): the verified part under a
+    ``.tmp`` name, to be ``publish``ed once the transaction has committed, or
+    None if nothing matched."""
+    params = {"lo": _utc(month), "hi": _utc(partitions.add_months(month, 1))}
+    where = ""
+    if closed_only:
+        where = "AND CAST(s.status AS text) IN ('stopped', 'cancelled')"
+    out_dir = month_dir(month)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"part-{int(time.time() * 1000)}.csv.gz"
+    tmp = Path(f"{path}.tmp")
+
+    ids, digest = [], hashlib.sha256()
+    result = await conn.stream(text(SELECT_SQL.format(source=source, where=where)), params)
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(COLUMNS)
+        async for row in result:
+            ids.append(row.id)
+            w.writerow([_cell(v) for v in row])
+            if buf.tell() > 1 << 16:
+                digest.update(buf.getvalue().encode())
+                f.write(buf.getvalue())
+                buf.seek(0)
+                buf.truncate()
+        digest.update(buf.getvalue().encode())
+        f.write(buf.getvalue())
+    await result.close()
+    if not ids:
+        tmp.unlink()
+        return None, 0
+
+    # read back what landed on disk before anything is deleted
+    check = hashlib.sha256()
+    with gzip.open(tmp, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            check.update(chunk)
+    if check.hexdigest() != digest.hexdigest():
+        tmp.unlink()
+        raise RuntimeError(f"archive of {source} {month:%Y-%m} failed verification")
+
+    try:
+        deleted = await conn.execute(
+            text(f"DELETE FROM {source} WHERE id = ANY(:ids) AND start_ts >= :lo AND start_ts < :hi"),
+            {**params, "ids": ids},
+        )
+        if deleted.rowcount != len(ids):
+            raise RuntimeError(f"archive of {source} {month:%Y-%m}: exported {len(ids)} rows, deleted {deleted.rowcount}")
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    return tmp, len(ids)
+
+
+def publish(tmp):
+    """Give a part whose delete has committed its final name and sidecar;
+    history() and the next run only ever see published parts."""
+    path = Path(str(tmp)[:-len(".tmp")])
+    os.replace(tmp, path)
+    Path(f"{path}.sha256").write_text(f"{_sha256_file(path)}  {path.name}\n")
+    return path
+
+
+def _part_ids(path):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return [int(rec["id"]) for rec in csv.DictReader(f)]
+
+
+async def recover(conn):
+    """Settle parts left under a ``.tmp`` name by a crashed run: published if
+    none of their rows are left in Postgres (the delete committed), removed
+    otherwise (it did not, and the month is archived again)."""
+    root = Path(settings.ARCHIVE_DIR) / "sessions"
+    leftovers = sorted(root.glob("month=*/*.tmp")) if root.is_dir() else []
+    if not leftovers:
+        return
+    sources = [partitions.PARENT] + [partitions.partition_name(m) for m in await partitions.detached_months(conn)]
+    exists = " UNION ALL ".join(f"SELECT 1 FROM {t} WHERE id = ANY(:ids)" for t in sources)
+    for tmp in leftovers:
+        try:
+            ids = await asyncio.to_thread(_part_ids, tmp)
+        except (OSError, EOFError, ValueError, KeyError):
+            ids = None  # never finished writing
+        if ids and (await conn.execute(text(f"SELECT EXISTS ({exists})"), {"ids": ids})).scalar() is False:
+            log.warning("archive: publishing %s left over from an interrupted run", tmp)
+            publish(tmp)
+        else:
+            log.warning("archive: removing unfinished %s", tmp)
+            tmp.unlink()
+
+
+async def months_due(conn, older_than_months, today=None):
+    cutoff = partitions.add_months(
+        partitions.month_start(today or datetime.datetime.now(datetime.timezone.utc)), -older_than_months)
+    rows = await conn.execute(text("""
+        SELECT DISTINCT CAST(date_trunc('month', start_ts AT TIME ZONE 'UTC') AS date)
+        FROM sessions
+        WHERE start_ts < :cutoff AND CAST(status AS text) IN ('stopped', 'cancelled')
+    """), {"cutoff": _utc(cutoff)})
+    return sorted(m for (m,) in rows)
+
+
+async def archive_old_sessions(engine, older_than_months, today=None):
+    """Archive every whole month older than ``older_than_months``, one
+    transaction per month, then any partitions detached for retention
+    (all rows, after which the table is dropped). Returns {month: rows}."""
+    done = {}
+    async with engine.connect() as conn:
+        await recover(conn)
+        due = await months_due(conn, older_than_months, today)
+        detached = await partitions.detached_months(conn)
+    jobs = [(m, partitions.PARENT, True) for m in due] + [(m, partitions.partition_name(m), False) for m in detached]
+    for month, source, closed_only in jobs:
+        tmp = None
+        try:
+            async with engine.begin() as conn:
+                tmp, rows = await archive_month(conn, month, source, closed_only)
+        except Exception:
+            if tmp is not None:
+                tmp.unlink(missing_ok=True)
+            raise
+        path = publish(tmp) if tmp is not None else None
+        if not closed_only:
+            # emptied above; separate transaction as the export cursor pins the table
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP TABLE {source}"))
+        if rows:
+            log.info("archived %d sessions from %s %s to %s", rows, source, f"{month:%Y-%m}", path)
+            done[month] = done.get(month, 0) + rows
+    return done
+
+
+def _read_part(path, keep, size=5000):
+    """Lists of up to ``size`` matching records of one part; blocking."""
+    batch = []
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        for rec in csv.DictReader(f):
+            rec = {k: (int(v) if k in _INTS and v != "" else (v or None)) for k, v in rec.items()}
+            if keep(rec):
+                batch.append(rec)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+async def history(db, start, end, machine_id=None, operator_id=None, job_card_id=None):
+    """Sessions with start_ts in [start, end), archived months first, then
+    whatever is still in Postgres. Yields JSON-ready dicts in the archive's
+    column layout. Archive parts are decoded in a worker thread, a batch at a
+    time, so the event loop keeps serving scans meanwhile."""
+    filters = {"machine_id": machine_id, "operator_id": operator_id, "job_card_id": job_card_id}
+    filters = {k: v for k, v in filters.items() if v is not None}
+
+    def keep(rec):
+        return (start <= datetime.datetime.fromisoformat(rec["start_ts"]) < end
+                and all(rec[k] == v for k, v in filters.items()))
+
+    for month in archived_months():
+        if _utc(partitions.add_months(month, 1)) <= start or _utc(month) >= end:
+            continue
+        for part in sorted(month_dir(month).glob("*.csv.gz")):
+            batches = _read_part(part, keep)
+            try:
+                while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+                    for rec in batch:
+                        yield rec
+            finally:
+                batches.close()
+
+    where = "".join(f" AND s.{k} = :{k}" for k in filters)
+    result = await db.stream(text(SELECT_SQL.format(source=partitions.PARENT, where=where)),
+                             {"lo": start, "hi": end, **filters})
+    async for row in result:
+        yield {k: _cell(v) if isinstance(v, datetime.datetime) else v for k, v in row._mapping.items()}
@@ -0,0 +1,106 @@
+"""Floor event fan-out for SSE/WebSocket clients.
+
+publish() never waits on a client: with REDIS_URL set the event goes to a
+Redis channel and every worker process relays it to its own subscribers,
+otherwise it is delivered to this process's subscribers directly. Each
+subscriber has a bounded queue; when a consumer falls behind the oldest
+events are dropped and counted instead of growing memory or blocking scans.
+"""
+import asyncio, datetime, json, logging
+import redis.asyncio as aioredis
+from app.core.config import settings
+from app.services.redis_client import get_redis
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "cnc:events"
+
+_subscribers = set()
+_tasks = set()
+_listener = None
+
+
+class Subscriber:
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def offer(self, data: str):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+
+def _fanout(data: str):
+    for sub in list(_subscribers):
+        sub.offer(data)
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _publish_redis(r, messages):
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for data in messages:
+                pipe.publish(CHANNEL, data)
+            await pipe.execute()
+    except Exception:
+        log.warning("events: redis publish failed, delivering locally", exc_info=True)
+        for data in messages:
+            _fanout(data)
+
+
+def _default(o):
+    return o.isoformat() if isinstance(o, datetime.datetime) else str(o)
+
+
+def publish(*events):
+    """Queue events for delivery, in order, without blocking the caller."""
+    messages = [json.dumps(e, default=_default) for e in events]
+    if not messages:
+        return
+    r = get_redis()
+    if r is None:
+        for data in messages:
+            _fanout(data)
+    else:
+        _spawn(_publish_redis(r, messages))
+
+
+async def _listen():
+    # dedicated connection: the shared client has a short socket timeout
+    client = aioredis.from_url(settings.REDIS_URL)
+    while _subscribers:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(CHANNEL)
+                while _subscribers:
+                    msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if msg is not None:
+                        _fanout(msg["data"].decode())
+        except Exception:
+            log.warning("events: redis subscription lost, retrying", exc_info=True)
+            await asyncio.sleep(1)
+    await client.close()
+
+
+def subscribe() -> Subscriber:
+    global _listener
+    sub = Subscriber(settings.EVENTS_BUFFER_SIZE)
+    _subscribers.add(sub)
+    if get_redis() is not None and (_listener is None or _listener.done()):
+        _listener = asyncio.create_task(_listen())
+    return sub
+
+
+def unsubscribe(sub: Subscriber):
+    _subscribers.discard(sub)
+
+
+def subscriber_count() -> int:
+    return len(_subscribers)
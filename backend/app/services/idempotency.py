@@ -0,0 +1,110 @@
+"""Idempotency-Key support for POST routes.
+
+The key is claimed with an INSERT in the same transaction as the request's
+own writes and the response is stored before that transaction commits. A
+concurrent duplicate therefore blocks on the primary key until the first
+request commits (and then replays its response) or rolls back (and then
+runs itself). Failed requests store nothing, so they can be retried.
+"""
+import datetime, hashlib, json
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import bindparam, delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from app.core.config import settings
+from app.db.models import IdempotencyKey
+
+def _fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def claim(db, scope: str, key: str, payload):
+    """Reserve ``key`` for this request.
+
+    Returns None when the caller should run the request, or a JSONResponse
+    replaying the stored result of an earlier request with the same key.
+    """
+    if len(key) > 255:
+        raise HTTPException(400, "Idempotency-Key too long")
+    fingerprint = _fingerprint(payload)
+    expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+    stmt = insert(IdempotencyKey).values(scope=scope, key=key, request_hash=fingerprint)
+    # an expired key is taken over as if it were new
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+        set_={"request_hash": fingerprint, "response": None, "created_at": stmt.excluded.created_at},
+        where=IdempotencyKey.created_at < expired,
+    ).returning(IdempotencyKey.key)
+    if (await db.execute(stmt)).first() is not None:
+        return None
+    row = (await db.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    )).first()
+    if row.request_hash != fingerprint:
+        raise HTTPException(422, "Idempotency-Key was already used with a different request")
+    if row.response is None:
+        raise HTTPException(409, "A request with this Idempotency-Key is still in progress")
+    return JSONResponse(row.response, headers={"Idempotent-Replayed": "true"})
+
+async def store(db, scope: str, key: str, response):
+    """Attach the response to a claimed key; commit it with the request."""
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+        .values(response=response)
+    )
+    return response
+
+async def claim_many(db, scope: str, items):
+    """``claim`` for the items of a batch, {key: payload}, in two statements.
+
+    Returns (replays, errors): stored responses of keys an earlier request
+    already answered and the reason a key cannot be used; every other key
+    is now claimed by the caller. Nothing raises, so one bad item does not
+    fail the batch.
+    """
+    errors = {k: "Idempotency-Key too long" for k in items if len(k) > 255}
+    prints = {k: _fingerprint(p) for k, p in items.items() if k not in errors}
+    if not prints:
+        return {}, errors
+    expired = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+    stmt = insert(IdempotencyKey).values([{"scope": scope, "key": k, "request_hash": f} for k, f in prints.items()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+        set_={"request_hash": stmt.excluded.request_hash, "response": None, "created_at": stmt.excluded.created_at},
+        where=IdempotencyKey.created_at < expired,
+    ).returning(IdempotencyKey.key)
+    claimed = set((await db.execute(stmt)).scalars())
+    replays = {}
+    taken = [k for k in prints if k not in claimed]
+    if taken:
+        rows = await db.execute(
+            select(IdempotencyKey.key, IdempotencyKey.request_hash, IdempotencyKey.response)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key.in_(taken))
+        )
+        for key, request_hash, response in rows:
+            if request_hash != prints[key]:
+                errors[key] = "Idempotency-Key was already used with a different request"
+            elif response is None:
+                errors[key] = "A request with this Idempotency-Key is still in progress"
+            else:
+                replays[key] = response
+    return replays, errors
+
+async def store_many(db, scope: str, responses):
+    """``store`` for many claimed keys, {key: response}."""
+    if responses:
+        t = IdempotencyKey.__table__
+        await db.execute(
+            update(t).where(t.c.scope == scope, t.c.key == bindparam("k")).values(response=bindparam("r")),
+            [{"k": k, "r": r} for k, r in responses.items()],
+        )
+
+async def release_many(db, scope: str, keys):
+    """Drop keys claimed by this transaction without a response, so a
+    request that was not applied can be retried under the same key."""
+    if keys:
+        await db.execute(
+            delete(IdempotencyKey)
+            .where(IdempotencyKey.scope == scope, IdempotencyKey.key.in_(keys), IdempotencyKey.response.is_(None))
+        )
@@ -0,0 +1,77 @@
+"""Keyset pagination and NDJSON streaming for column-only list queries.
+
+Pages are ordered by (sort key, id) and the opaque cursor carries the last
+row's pair, so every page is an index range scan no matter how deep the
+client pages, unlike OFFSET. ``as_utc`` normalises the range parameters of
+the read-only routers and ``contains`` builds their substring search.
+"""
+import base64, datetime, json
+from sqlalchemy import tuple_
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def as_utc(ts: datetime.datetime):
+    """Query timestamps without an offset are taken as UTC."""
+    return ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)
+
+
+def contains(col, q: str):
+    """Case-insensitive substring match; %, _ and \\ in ``q`` match themselves."""
+    q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return col.ilike(f"%{q}%", escape="\\")
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """Return the (sort value, id) pair of a cursor issued for ``sort``."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise BadCursor("invalid cursor") from e
+    if not isinstance(values, list) or len(values) != 3 or values[0] != sort:
+        raise BadCursor("invalid cursor for this sort order")
+    return values[1:]
+
+
+def ordered(stmt, sort, sort_col, id_col, cursor=None):
+    """Order ``stmt`` by (sort_col, id_col), descending when ``sort`` starts
+    with "-", and start after ``cursor``."""
+    desc = sort.startswith("-")
+    key = tuple_(sort_col, id_col)
+    if cursor is not None:
+        after = tuple_(*decode_cursor(cursor, sort))
+        stmt = stmt.where(key < after if desc else key > after)
+    if desc:
+        return stmt.order_by(sort_col.desc(), id_col.desc())
+    return stmt.order_by(sort_col, id_col)
+
+
+async def page(db, stmt, sort, sort_value, limit):
+    """Fetch one page of a statement built with ``ordered``; ``sort_value``
+    maps a row to the value its sort column compared on."""
+    rows = (await db.execute(stmt.limit(limit + 1))).mappings().all()
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([sort, sort_value(last), last["id"]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _default(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+async def ndjson(db, stmt, chunk=1000):
+    """Stream every row of ``stmt`` as NDJSON through a server-side cursor."""
+    result = await db.stream(stmt.execution_options(yield_per=chunk))
+    async for part in result.mappings().partitions(chunk):
+        yield "".join(json.dumps(dict(r), default=_default) + "\n" for r in part)
@@ -0,0 +1,115 @@
+"""Monthly range partitions of the sessions table.
+
+Every month lives in ``sessions_YYYY_MM`` covering [first day, first day of
+next month) in UTC. ``sessions_default`` catches anything outside the
+attached months (clock skew, offline scans replayed from a detached month),
+so a scan never fails for lack of a partition. New months are built as plain
+tables, filled with any matching rows from the default partition and then
+attached, which only needs a light lock on the parent.
+"""
+import datetime, re
+from sqlalchemy import text
+
+PARENT = "sessions"
+DEFAULT = "sessions_default"
+_NAME = re.compile(r"^sessions_(\d{4})_(\d{2})$")
+# serialises maintenance between app startup and the worker
+_LOCK_KEY = 0x5E5510
+
+
+def month_start(d):
+    return datetime.date(d.year, d.month, 1)
+
+
+def add_months(month, n):
+    y, m = divmod(month.month - 1 + n, 12)
+    return datetime.date(month.year + y, m + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_{month:%Y_%m}"
+
+
+def _bound(month):
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def _piece_owner_index(name):
+    # per partition stand-in for uniq_piece_owner; column order also serves
+    # the max(piece_index) lookup of the scan toggle
+    return (f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_piece_owner "
+            f"ON {name} (job_card_id, machine_id, operator_id, piece_index)")
+
+
+def _months(names):
+    months = []
+    for name in names:
+        m = _NAME.match(name)
+        if m:
+            months.append(datetime.date(int(m.group(1)), int(m.group(2)), 1))
+    return sorted(months)
+
+
+async def attached_months(conn):
+    rows = await conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+    """), {"parent": PARENT})
+    return _months(name for (name,) in rows)
+
+
+async def detached_months(conn):
+    """Month tables left behind by detach_old_partitions."""
+    rows = await conn.execute(text("""
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relname LIKE 'sessions\\_%'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+    """))
+    return _months(name for (name,) in rows)
+
+
+async def create_partition(conn, month):
+    name, lo, hi = partition_name(month), _bound(month), _bound(add_months(month, 1))
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)"))
+    await conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT} WHERE start_ts >= {lo} AND start_ts < {hi} RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """))
+    await conn.execute(text(_piece_owner_index(name)))
+    await conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ({lo}) TO ({hi})"))
+
+
+async def ensure_partitions(conn, ahead, today=None):
+    """Create the default partition and every month from the current one to
+    ``ahead`` months out. Returns the names created."""
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT} PARTITION OF {PARENT} DEFAULT"))
+    await conn.execute(text(_piece_owner_index(DEFAULT)))
+    current = month_start(today or datetime.datetime.now(datetime.timezone.utc))
+    have = set(await attached_months(conn))
+    created = []
+    for n in range(ahead + 1):
+        month = add_months(current, n)
+        if month not in have:
+            await create_partition(conn, month)
+            created.append(partition_name(month))
+    return created
+
+
+async def detach_old_partitions(conn, keep_months, today=None):
+    """Detach months older than ``keep_months`` before the current one. The
+    tables are kept, only no longer scanned; returns their names."""
+    if keep_months <= 0:
+        return []
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+    cutoff = add_months(month_start(today or datetime.datetime.now(datetime.timezone.utc)), -keep_months)
+    detached = []
+    for month in await attached_months(conn):
+        if month < cutoff:
+            name = partition_name(month)
+            await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            detached.append(name)
+    return detached
@@ -0,0 +1,105 @@
+"""Job card PDFs on disk, keyed by a hash of everything printed on them.
+
+The key covers the card, its drawing and pdfgen.LAYOUT_VERSION, so an edited
+card or drawing simply gets a new file and nothing has to be invalidated;
+the key doubles as a strong ETag and can be compared without rendering.
+The directory is shared by the API and the worker. Files are written to a
+temporary name and renamed, so readers never see half a PDF. Every hit
+touches the file's mtime and the oldest files go first once the directory
+outgrows PDF_CACHE_MAX_MB.
+"""
+import hashlib, json, logging, os, tempfile
+from pathlib import Path
+from app.core.config import settings
+from app.services.pdfgen import LAYOUT_VERSION, render_job_cards
+
+log = logging.getLogger(__name__)
+
+_size = None  # this process's estimate of the directory size, None until scanned
+
+
+def key(job_card, drawing):
+    fields = [LAYOUT_VERSION, job_card.card_number, job_card.qr_payload, drawing.drawing_number,
+              drawing.job_id, drawing.planned_pieces, drawing.planned_time_per_piece]
+    return hashlib.sha256(json.dumps(fields, default=str).encode()).hexdigest()
+
+
+def path(k):
+    return Path(settings.PDF_CACHE_DIR) / k[:2] / f"{k}.pdf"
+
+
+def get_or_create(job_card, drawing):
+    """Path of the cached PDF, rendered first if missing. Blocking."""
+    global _size
+    p = path(key(job_card, drawing))
+    try:
+        os.utime(p)
+        return p
+    except FileNotFoundError:
+        pass
+    p.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=p.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            render_job_cards([(job_card, drawing)], f)
+        os.replace(tmp, p)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if _size is None:
+        _size = _scan()[1]
+    else:
+        _size += p.stat().st_size
+    if _size > settings.PDF_CACHE_MAX_MB << 20:
+        evict(keep=p)
+    return p
+
+
+def open_pdf(job_card, drawing):
+    """``get_or_create``, opened for reading. An open file outlives an unlink,
+    so another process evicting it can no longer break a response that is
+    still to be sent; one evicted before it was opened is rendered again.
+    Blocking."""
+    try:
+        return open(get_or_create(job_card, drawing), "rb")
+    except FileNotFoundError:
+        return open(get_or_create(job_card, drawing), "rb")
+
+
+def _scan():
+    files, total = [], 0
+    root = Path(settings.PDF_CACHE_DIR)
+    if root.is_dir():
+        for sub in os.scandir(root):
+            if sub.is_dir():
+                for e in os.scandir(sub.path):
+                    if e.name.endswith(".pdf"):
+                        st = e.stat()
+                        files.append((st.st_mtime, st.st_size, e.path))
+                        total += st.st_size
+    return files, total
+
+
+def evict(max_bytes=None, keep=None):
+    """Drop least recently used PDFs until the directory fits; returns the
+    number removed. Other processes only see evictions on their next scan,
+    so the worker also trims periodically."""
+    global _size
+    max_bytes = settings.PDF_CACHE_MAX_MB << 20 if max_bytes is None else max_bytes
+    files, total = _scan()
+    removed = 0
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        if keep is not None and name == str(keep):
+            continue
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    _size = total
+    if removed:
+        log.info("pdf cache: evicted %d files, %d bytes left", removed, total)
+    return removed
@@ -1,28 +1,49 @@
 from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 from io import BytesIO
 from app.db.models import JobCard, Drawing
 import qrcode
-from PIL import Image
 
-def generate_job_card_pdf(job_card: JobCard, drawing: Drawing):
-    buf = BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    width, height = A4
-    c.setFont("Helvetica", 14)
-    c.drawString(40, height-40, f"Průvodka: {job_card.card_number}")
-    c.setFont("Helvetica", 12)
-    c.drawString(40, height-80, f"Výkres: {drawing.drawing_number}  (Job {drawing.job_id})")
-    c.drawString(40, height-110, f"Plánovaný kusů: {drawing.planned_pieces}")
-    c.drawString(40, height-140, f"Plánovaný čas / kus (s): {drawing.planned_time_per_piece}")
-    # generate qr image
-    qr_img = qrcode.make(job_card.qr_payload)
-    qr_buf = BytesIO()
-    qr_img.save(qr_buf, format="PNG")
-    qr_buf.seek(0)
-    # draw QR onto PDF
-    c.drawInlineImage(Image.open(qr_buf), 40, height-380, width=160, height=160)
+WIDTH, HEIGHT = A4
+# part of the PDF cache key; bump whenever the page layout changes
+LAYOUT_VERSION = 1
+# (label, font size, baseline); the value follows the label on the same line
+LABELS = [
+    ("Průvodka: ", 14, HEIGHT-40),
+    ("Výkres: ", 12, HEIGHT-80),
+    ("Plánovaný kusů: ", 12, HEIGHT-110),
+    ("Plánovaný čas / kus (s): ", 12, HEIGHT-140),
+]
+VALUE_X = [40 + stringWidth(label, "Helvetica", size) for label, size, _ in LABELS]
+
+def _labels_form(c):
+    # the static part of every page, drawn once per document and reused
+    c.beginForm("labels")
+    for label, size, y in LABELS:
+        c.setFont("Helvetica", size)
+        c.drawString(40, y, label)
+    c.endForm()
+
+def _page(c, job_card, drawing):
+    c.doForm("labels")
+    values = [job_card.card_number, f"{drawing.drawing_number}  (Job {drawing.job_id})",
+              drawing.planned_pieces, drawing.planned_time_per_piece]
+    for (_, size, y), x, value in zip(LABELS, VALUE_X, values):
+        c.setFont("Helvetica", size)
+        c.drawString(x, y, f"{value}")
+    c.drawInlineImage(qrcode.make(job_card.qr_payload).get_image(), 40, HEIGHT-380, width=160, height=160)
     c.showPage()
+
+def render_job_cards(cards, out):
+    """Write one page per (job_card, drawing) pair into the file object ``out``."""
+    c = canvas.Canvas(out, pagesize=A4)
+    _labels_form(c)
+    for job_card, drawing in cards:
+        _page(c, job_card, drawing)
     c.save()
-    buf.seek(0)
-    return buf.read()
+
+def generate_job_card_pdf(job_card: JobCard, drawing: Drawing):
+    buf = BytesIO()
+    render_job_cards([(job_card, drawing)], buf)
+    return buf.getvalue()
@@ -1,5 +1,12 @@
-import hmac, hashlib, base64, datetime
+import hmac, hashlib, base64, datetime, threading
 from app.core.config import settings
+from app.services.cache import LRUCache, MISSING
+
+# verified tokens, keyed by token; entries belong to _cache_secret
+_verified = LRUCache(settings.QR_CACHE_SIZE)
+_cache_secret = settings.QR_SECRET
+_secret_lock = threading.Lock()
+_SIG_LEN = hashlib.sha256().digest_size
 
 def build_qr_payload(job_card_id: int, issued_at: datetime.datetime = None) -> str:
     if issued_at is None:
@@ -9,11 +16,14 @@ def build_qr_payload(job_card_id: int, issued_at: datetime.datetime = None) -> s
     token = base64.urlsafe_b64encode(payload.encode() + b"." + sig).decode()
     return token
 
-def verify_qr_payload(token: str):
+def _verify(token: str, secret: str):
     try:
         raw = base64.urlsafe_b64decode(token.encode())
-        payload_part, sig = raw.rsplit(b".", 1)
-        expected = hmac.new(settings.QR_SECRET.encode(), payload_part, hashlib.sha256).digest()
+        # the raw digest may itself contain b".", so split at its fixed length
+        payload_part, dot, sig = raw[:-_SIG_LEN - 1], raw[-_SIG_LEN - 1:-_SIG_LEN], raw[-_SIG_LEN:]
+        if dot != b".":
+            return None
+        expected = hmac.new(secret.encode(), payload_part, hashlib.sha256).digest()
         if not hmac.compare_digest(expected, sig):
             return None
         payload = payload_part.decode()
@@ -21,3 +31,22 @@ def verify_qr_payload(token: str):
         return {"job_card_id": int(job_card_id_str), "issued_at": issued_at}
     except Exception:
         return None
+
+def verify_qr_payload(token: str):
+    global _cache_secret
+    secret = settings.QR_SECRET
+    if secret != _cache_secret:
+        # rotated secret: every cached verdict is stale
+        with _secret_lock:
+            if secret != _cache_secret:
+                _verified.clear()
+                _cache_secret = secret
+    cached = _verified.get(token)
+    if cached is MISSING:
+        cached = _verify(token, secret)
+        # garbage is cached briefly so a burst of bad scans stays cheap
+        _verified.set(token, cached, ttl=None if cached else settings.QR_NEGATIVE_TTL_SECONDS)
+    return dict(cached) if cached else None
+
+def qr_cache_stats():
+    return _verified.stats()
@@ -0,0 +1,13 @@
+import redis.asyncio as aioredis
+from app.core.config import settings
+
+_client = None
+
+def get_redis():
+    """Shared asyncio Redis client, or None when REDIS_URL is not set."""
+    global _client
+    if not settings.REDIS_URL:
+        return None
+    if _client is None:
+        _client = aioredis.from_url(settings.REDIS_URL, socket_timeout=settings.REDIS_TIMEOUT_SECONDS)
+    return _client
@@ -0,0 +1,71 @@
+"""Read-through cache for reference data (job cards, drawings, machines, users).
+
+Values are plain dicts so they can be shared between requests and stored in
+Redis as JSON. The in-process tier has a short TTL because it is only
+invalidated locally; the Redis tier, when REDIS_URL is set, is shared by all
+workers and must be invalidated by any endpoint that changes a cached row.
+Missing rows are never cached, so creating a record needs no invalidation.
+"""
+import json, logging
+from app.core.config import settings
+from app.db.models import JobCard, Drawing, Machine, User
+from app.services.cache import LRUCache, MISSING
+from app.services.redis_client import get_redis
+
+log = logging.getLogger(__name__)
+
+_local = LRUCache(settings.REFDATA_CACHE_SIZE)
+_PREFIX = "refdata:"
+
+def _row(obj, *cols):
+    return {c: getattr(obj, c) for c in cols}
+
+async def _cached(key, loader):
+    value = _local.get(key)
+    if value is not MISSING:
+        return value
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = await r.get(_PREFIX + key)
+            if raw is not None:
+                value = json.loads(raw)
+                _local.set(key, value, ttl=settings.REFDATA_TTL_SECONDS)
+                return value
+        except Exception:
+            log.warning("refdata: redis read failed for %s", key, exc_info=True)
+    value = await loader()
+    if value is not None:
+        _local.set(key, value, ttl=settings.REFDATA_TTL_SECONDS)
+        if r is not None:
+            try:
+                await r.set(_PREFIX + key, json.dumps(value), ex=settings.REFDATA_REDIS_TTL_SECONDS)
+            except Exception:
+                log.warning("refdata: redis write failed for %s", key, exc_info=True)
+    return value
+
+async def invalidate(*keys):
+    for key in keys:
+        _local.pop(key)
+    r = get_redis()
+    if r is not None and keys:
+        try:
+            await r.delete(*[_PREFIX + k for k in keys])
+        except Exception:
+            log.warning("refdata: redis invalidation failed for %s", keys, exc_info=True)
+
+def _get(model, *cols):
+    async def get(db, id: int):
+        async def load():
+            obj = await db.get(model, id)
+            return _row(obj, *cols) if obj is not None else None
+        return await _cached(f"{model.__tablename__}:{id}", load)
+    return get
+
+get_job_card = _get(JobCard, "id", "drawing_id", "card_number", "qr_payload")
+get_drawing = _get(Drawing, "id", "job_id", "drawing_number", "planned_time_per_piece", "planned_pieces")
+get_machine = _get(Machine, "id", "name")
+get_user = _get(User, "id", "username", "full_name")
+
+def cache_stats():
+    return _local.stats()
@@ -0,0 +1,116 @@
+"""Aggregate reports over stopped sessions, computed entirely in SQL.
+
+Every query filters on sessions.start_ts so only the partitions of the
+requested range are read.
+"""
+from sqlalchemy import text
+
+# dimension -> (keys grouped on per session, output columns)
+DIMENSIONS = {
+    "drawing": (["jc.drawing_id"], ["h.drawing_id", "dn.drawing_number"]),
+    "job": (["dr.job_id"], ["h.job_id", "j.name AS job_name"]),
+    "operator": (["s.operator_id"], ["h.operator_id", "u.username AS operator"]),
+    "machine": (["s.machine_id"], ["h.machine_id", "m.name AS machine"]),
+    "day": (["CAST(timezone(:tz, s.start_ts) AS date) AS day"], ["h.day"]),
+}
+JOINS = {
+    "drawing": "LEFT JOIN drawings dn ON dn.id = h.drawing_id",
+    "job": "LEFT JOIN jobs j ON j.id = h.job_id",
+    "operator": "LEFT JOIN users u ON u.id = h.operator_id",
+    "machine": "LEFT JOIN machines m ON m.id = h.machine_id",
+}
+FILTERS = {
+    "drawing_id": "jc.drawing_id",
+    "job_id": "dr.job_id",
+    "operator_id": "s.operator_id",
+    "machine_id": "s.machine_id",
+}
+
+# percentile_cont(p) from a per-group histogram of whole seconds: the value at
+# 0-based position p*(n-1), interpolated between its floor and ceiling
+_PCT = """
+    min(d) FILTER (WHERE below + n > floor({p} * (total - 1)))
+    + ({p} * (max(total) - 1) - floor({p} * (max(total) - 1)))
+    * (min(d) FILTER (WHERE below + n > ceil({p} * (total - 1)))
+       - min(d) FILTER (WHERE below + n > floor({p} * (total - 1))))
+"""
+
+EFFICIENCY_SQL = """
+WITH h AS (
+    SELECT {key_cols}, s.duration_seconds AS d, count(*) AS n,
+           sum(dr.planned_time_per_piece) AS planned
+    FROM sessions s
+    JOIN job_cards jc ON jc.id = s.job_card_id
+    JOIN drawings dr ON dr.id = jc.drawing_id
+    WHERE s.status = 'stopped' AND s.duration_seconds IS NOT NULL
+      AND s.start_ts >= :start AND s.start_ts < :end {where}
+    GROUP BY {key_names}, d
+),
+c AS (
+    SELECT {out_cols}, h.d, h.n, h.planned,
+           sum(h.n) OVER (PARTITION BY {h_keys} ORDER BY h.d) - h.n AS below,
+           sum(h.n) OVER (PARTITION BY {h_keys}) AS total
+    FROM h
+    {joins}
+)
+SELECT {out_names},
+       sum(n) AS pieces,
+       CAST(sum(d * n) AS float) / sum(n) AS mean_seconds,
+       {p50} AS median_seconds,
+       {p90} AS p90_seconds,
+       CAST(sum(planned) AS float) / sum(n) AS planned_seconds,
+       CAST(sum(planned) AS float) / NULLIF(sum(d * n), 0) AS efficiency
+FROM c
+GROUP BY {out_names}
+ORDER BY {out_names}
+"""
+
+
+def _name(col):
+    return col.rsplit(" AS ", 1)[-1].split(".")[-1]
+
+
+async def efficiency(db, start, end, group_by, tz="UTC", filters=None):
+    """Pieces, mean/median/p90 actual seconds, planned seconds and the
+    planned/actual ratio (above 1 means faster than planned) per group.
+
+    Durations are whole seconds, so sessions are collapsed into a
+    (group, duration) histogram in one pass; the percentiles are then exact
+    percentile_cont values read off its cumulative counts instead of sorting
+    every session of every group.
+    """
+    key_cols, out_cols, joins = [], [], []
+    for name in group_by:
+        keys, cols = DIMENSIONS[name]
+        key_cols += keys
+        out_cols += cols
+        if name in JOINS:
+            joins.append(JOINS[name])
+    filters = {k: v for k, v in (filters or {}).items() if v is not None}
+    key_names = [_name(c) for c in key_cols]
+    sql = EFFICIENCY_SQL.format(
+        key_cols=", ".join(key_cols),
+        key_names=", ".join(key_names),
+        where="".join(f" AND {FILTERS[k]} = :{k}" for k in filters),
+        out_cols=", ".join(out_cols),
+        h_keys=", ".join(f"h.{k}" for k in key_names),
+        joins="\n    ".join(joins),
+        out_names=", ".join(_name(c) for c in out_cols),
+        p50=_PCT.format(p=0.5),
+        p90=_PCT.format(p=0.9),
+    )
+    params = {"start": start, "end": end, **filters}
+    if "day" in group_by:
+        params["tz"] = tz
+    rows = (await db.execute(text(sql), params)).mappings().all()
+    return [_rounded(r) for r in rows]
+
+
+def _rounded(row):
+    out = dict(row)
+    for k in ("mean_seconds", "median_seconds", "p90_seconds", "planned_seconds"):
+        if out[k] is not None:
+            out[k] = round(float(out[k]), 1)
+    if out["efficiency"] is not None:
+        out["efficiency"] = round(out["efficiency"], 3)
+    return out
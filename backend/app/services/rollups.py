@@ -0,0 +1,222 @@
+"""Machine-hour and operator-day rollups of stopped sessions.
+
+Every stop bumps sessions.updated_at. The worker walks stopped sessions past
+the (updated_at, id) watermark in batches, marks each bucket the session's
+interval touches as dirty and recomputes those buckets from sessions, so a
+stop that arrives late, hours or weeks after its piece was cut, simply
+rewrites the old buckets. Buckets hold sums only; ratios are derived when
+read, so any range of buckets adds up exactly.
+
+pieces and planned/run seconds go to the bucket a session stops in;
+busy_seconds is the union of the stopped intervals overlapping the bucket,
+so parallel pieces on one machine (or one operator) count once.
+first_start is the earliest start among those intervals and bounds the
+session scan of the next recompute of that bucket.
+"""
+import datetime, logging, zoneinfo
+from sqlalchemy import text
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+NAME = "sessions"
+
+BATCH_SQL = text("""
+SELECT id, start_ts, stop_ts, updated_at, machine_id, operator_id
+FROM sessions
+WHERE status = 'stopped' AND stop_ts IS NOT NULL
+  AND (updated_at, id) > (CAST(:after_ts AS timestamptz), CAST(:after_id AS integer))
+  AND updated_at < CAST(:upto AS timestamptz)
+ORDER BY updated_at, id
+LIMIT :limit
+""")
+
+# rollup table, its dimension and bucket columns, the bucket's bounds given
+# a row d of dirty buckets, and the dirty buckets of a set of sessions
+_MACHINE = {
+    "table": "machine_hourly_stats", "dim": "machine_id", "bucket": "hour",
+    "lo": "d.hour", "hi": "d.hour + interval '1 hour'",
+    "dirty": "SELECT DISTINCT machine_id, generate_series(date_trunc('hour', start_ts), date_trunc('hour', stop_ts), interval '1 hour') AS hour",
+    "cast": "timestamptz",
+}
+_OPERATOR = {
+    "table": "operator_daily_stats", "dim": "operator_id", "bucket": "day",
+    "lo": "timezone(:tz, CAST(d.day AS timestamp))", "hi": "timezone(:tz, CAST(d.day + 1 AS timestamp))",
+    "dirty": "SELECT DISTINCT operator_id, CAST(generate_series(CAST(timezone(:tz, start_ts) AS date), CAST(timezone(:tz, stop_ts) AS date), interval '1 day') AS date) AS day",
+    "cast": "date",
+}
+
+RECOMPUTE_SQL = """
+WITH b AS (
+    SELECT d.{dim}, d.{bucket}, {lo} AS lo, {hi} AS hi
+    FROM unnest(CAST(:dims AS integer[]), CAST(:buckets AS {cast}[])) AS d({dim}, {bucket})
+),
+iv AS (
+    SELECT b.{dim}, b.{bucket}, s.start_ts, s.duration_seconds, dr.planned_time_per_piece AS planned,
+           s.stop_ts >= b.lo AND s.stop_ts < b.hi AS ends_here,
+           greatest(s.start_ts, b.lo) AS s_lo, least(s.stop_ts, b.hi) AS s_hi
+    FROM b
+    JOIN sessions s ON s.{dim} = b.{dim} AND s.start_ts < b.hi AND s.stop_ts >= b.lo
+    LEFT JOIN job_cards jc ON jc.id = s.job_card_id
+    LEFT JOIN drawings dr ON dr.id = jc.drawing_id
+    WHERE s.status = 'stopped'
+      AND s.start_ts >= CAST(:since AS timestamptz) AND s.start_ts < CAST(:until AS timestamptz)
+),
+runs AS (
+    SELECT iv.*, max(s_hi) OVER (PARTITION BY {dim}, {bucket} ORDER BY s_lo, s_hi
+                                 ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS prev_hi
+    FROM iv
+)
+INSERT INTO {table} AS t ({dim}, {bucket}, pieces, busy_seconds, run_seconds, planned_seconds, first_start)
+SELECT {dim}, {bucket},
+       count(*) FILTER (WHERE ends_here),
+       round(sum(greatest(0, extract(epoch FROM s_hi - greatest(s_lo, coalesce(prev_hi, s_lo)))))),
+       coalesce(sum(duration_seconds) FILTER (WHERE ends_here), 0),
+       coalesce(sum(planned) FILTER (WHERE ends_here), 0),
+       min(start_ts)
+FROM runs
+GROUP BY {dim}, {bucket}
+ON CONFLICT ({dim}, {bucket}) DO UPDATE
+SET pieces = EXCLUDED.pieces,
+    busy_seconds = EXCLUDED.busy_seconds,
+    run_seconds = EXCLUDED.run_seconds,
+    planned_seconds = EXCLUDED.planned_seconds,
+    first_start = EXCLUDED.first_start
+"""
+
+
+async def _recompute(conn, spec, batch_ids, params):
+    dirty = (await conn.execute(text(f"""
+        {spec['dirty']}
+        FROM sessions
+        WHERE id = ANY(:ids) AND start_ts >= CAST(:batch_lo AS timestamptz) AND start_ts <= CAST(:batch_hi AS timestamptz)
+          AND {spec['dim']} IS NOT NULL
+    """), {**params, "ids": batch_ids})).all()
+    if not dirty:
+        return 0
+    dims, buckets = [d for d, _ in dirty], [b for _, b in dirty]
+    # a bucket's sessions start no earlier than the earliest start already
+    # recorded for it or the earliest start in this batch
+    since = (await conn.execute(text(f"""
+        SELECT min(t.first_start)
+        FROM unnest(CAST(:dims AS integer[]), CAST(:buckets AS {spec['cast']}[])) AS d(dim, bucket)
+        JOIN {spec['table']} t ON t.{spec['dim']} = d.dim AND t.{spec['bucket']} = d.bucket
+    """), {"dims": dims, "buckets": buckets})).scalar()
+    since = min(filter(None, (since, params["batch_lo"])))
+    sql = RECOMPUTE_SQL.format(**spec)
+    await conn.execute(text(sql), {**params, "dims": dims, "buckets": buckets, "since": since, "until": params["until"]})
+    return len(dirty)
+
+
+async def _watermark(conn):
+    row = (await conn.execute(text(
+        "SELECT updated_at, session_id FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+    ), {"name": NAME})).first()
+    if row is None:
+        await conn.execute(text(
+            "INSERT INTO rollup_watermarks (name, updated_at, session_id) VALUES (:name, '1970-01-01 00:00:00+00', 0) ON CONFLICT DO NOTHING"
+        ), {"name": NAME})
+        row = (await conn.execute(text(
+            "SELECT updated_at, session_id FROM rollup_watermarks WHERE name = :name FOR UPDATE"
+        ), {"name": NAME})).first()
+    return row
+
+
+async def run_batch(conn, limit, lag_seconds, tz=None):
+    """Fold up to ``limit`` stops past the watermark into the rollups, in the
+    caller's transaction. Stops younger than ``lag_seconds`` wait for the next
+    run, so a slow transaction that committed after a faster one is not
+    skipped. Returns the number of sessions read."""
+    after_ts, after_id = await _watermark(conn)
+    upto = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=lag_seconds)
+    batch = (await conn.execute(BATCH_SQL, {"after_ts": after_ts, "after_id": after_id,
+                                            "upto": upto, "limit": limit})).all()
+    if not batch:
+        return 0
+    params = {
+        "tz": tz or settings.REPORT_TIMEZONE,
+        "batch_lo": min(r.start_ts for r in batch),
+        "batch_hi": max(r.start_ts for r in batch),
+        # past the end of the last bucket touched, local day included
+        "until": max(r.stop_ts for r in batch) + datetime.timedelta(days=2),
+    }
+    ids = [r.id for r in batch]
+    hours = await _recompute(conn, _MACHINE, ids, params)
+    days = await _recompute(conn, _OPERATOR, ids, params)
+    last = batch[-1]
+    await conn.execute(text(
+        "UPDATE rollup_watermarks SET updated_at = :ts, session_id = :id WHERE name = :name"
+    ), {"ts": last.updated_at, "id": last.id, "name": NAME})
+    log.debug("rollups: %d sessions, %d machine hours, %d operator days", len(batch), hours, days)
+    return len(batch)
+
+
+async def catch_up(engine, limit=None, lag_seconds=None, max_batches=None):
+    """Run batches, one transaction each, until the watermark is current."""
+    limit = limit or settings.ROLLUP_BATCH_SIZE
+    lag_seconds = settings.ROLLUP_LAG_SECONDS if lag_seconds is None else lag_seconds
+    total, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        async with engine.begin() as conn:
+            n = await run_batch(conn, limit, lag_seconds)
+        total += n
+        batches += 1
+        if n < limit:
+            break
+    return total
+
+
+MACHINE_STATS_SQL = """
+SELECT machine_id, {bucket} AS bucket_start, {bucket_end} AS bucket_end,
+       sum(pieces) AS pieces, sum(busy_seconds) AS busy_seconds,
+       sum(run_seconds) AS run_seconds, sum(planned_seconds) AS planned_seconds
+FROM machine_hourly_stats
+WHERE hour >= :start AND hour < :end {where}
+GROUP BY machine_id, 2, 3
+ORDER BY machine_id, 2
+"""
+OPERATOR_STATS_SQL = """
+SELECT operator_id, day AS bucket_start, day + 1 AS bucket_end,
+       pieces, busy_seconds, run_seconds, planned_seconds
+FROM operator_daily_stats
+WHERE day >= CAST(timezone(:tz, :start) AS date) AND day < CAST(timezone(:tz, :end) AS date) {where}
+ORDER BY operator_id, day
+"""
+_BUCKETS = {
+    "hour": ("hour", "hour + interval '1 hour'"),
+    "day": ("CAST(timezone(:tz, hour) AS date)", "CAST(timezone(:tz, hour) AS date) + 1"),
+}
+
+
+def _ratios(row, seconds):
+    out = dict(row)
+    out["availability"] = round(row["busy_seconds"] / seconds, 4) if seconds else None
+    out["performance"] = round(row["planned_seconds"] / row["run_seconds"], 4) if row["run_seconds"] else None
+    return out
+
+
+def _day_seconds(day, zone):
+    lo = datetime.datetime.combine(day, datetime.time(0), zone)
+    return (datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0), zone) - lo).total_seconds()
+
+
+async def machine_stats(db, start, end, bucket, tz, machine_id=None):
+    """Rows of summed machine-hour rollups per hour or local day, with
+    availability (busy / bucket length) and performance (planned / run)."""
+    zone = zoneinfo.ZoneInfo(tz)
+    where, params = "", {"start": start, "end": end, "tz": tz}
+    if machine_id is not None:
+        where, params["machine_id"] = "AND machine_id = :machine_id", machine_id
+    col, col_end = _BUCKETS[bucket]
+    rows = await db.execute(text(MACHINE_STATS_SQL.format(bucket=col, bucket_end=col_end, where=where)), params)
+    return [_ratios(r, 3600 if bucket == "hour" else _day_seconds(r["bucket_start"], zone)) for r in rows.mappings()]
+
+
+async def operator_stats(db, start, end, tz, operator_id=None):
+    """Operator-day rollups; days are REPORT_TIMEZONE days as rolled up."""
+    zone = zoneinfo.ZoneInfo(tz)
+    where, params = "", {"start": start, "end": end, "tz": tz}
+    if operator_id is not None:
+        where, params["operator_id"] = "AND operator_id = :operator_id", operator_id
+    rows = await db.execute(text(OPERATOR_STATS_SQL.format(where=where)), params)
+    return [_ratios(r, _day_seconds(r["bucket_start"], zone)) for r in rows.mappings()]
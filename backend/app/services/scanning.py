@@ -0,0 +1,305 @@
+import datetime
+from sqlalchemy import text, select, func, tuple_, literal_column
+from app.core.config import settings
+from app.db.models import Session as DBSession
+from app.services.sketch import BUCKET_SQL
+
+# Start-or-stop transition for one (job card, machine, operator) in a single
+# statement: close the open session if there is one, otherwise open a new one
+# with the next piece index. ON CONFLICT DO NOTHING lets the partition's
+# piece-owner unique index swallow a concurrent duplicate start, in which case
+# no row is returned.
+# A stop also bumps job_card_progress, so completion is read from one row
+# instead of counting the card's sessions, and the drawing's piece-time
+# sketch for this machine (app.services.sketch). The open-session lookup is bounded
+# by :since so it only touches the last few monthly partitions; a session
+# left open longer than SESSIONS_OPEN_LOOKBACK_DAYS is treated as abandoned.
+# The next piece index is looked up from :pieces_since, the first day of that
+# month, so every partition that may hold a conflicting index is searched and
+# no older one is; an owner idle for longer starts counting from 1 again.
+TOGGLE_SQL = text(f"""
+WITH params AS (
+    SELECT CAST(:job_card_id AS integer) AS job_card_id,
+           CAST(:operator_id AS integer) AS operator_id,
+           CAST(:machine_id AS integer) AS machine_id,
+           CAST(:ts AS timestamptz) AS ts
+),
+open_session AS (
+    SELECT s.id, s.start_ts
+    FROM sessions s, params p
+    WHERE s.job_card_id = p.job_card_id
+      AND s.machine_id = p.machine_id
+      AND s.operator_id = p.operator_id
+      AND s.status = 'started'
+      AND s.start_ts >= CAST(:since AS timestamptz)
+    ORDER BY s.start_ts DESC
+    LIMIT 1
+),
+closed AS (
+    UPDATE sessions s
+    SET stop_ts = p.ts,
+        duration_seconds = GREATEST(0, FLOOR(EXTRACT(EPOCH FROM (p.ts - s.start_ts))))::integer,
+        status = 'stopped',
+        updated_at = now()
+    FROM open_session o, params p
+    WHERE s.id = o.id AND s.start_ts = o.start_ts AND s.status = 'started'
+      AND s.start_ts >= CAST(:since AS timestamptz)
+    RETURNING s.id, s.start_ts, s.duration_seconds
+),
+opened AS (
+    INSERT INTO sessions (job_card_id, operator_id, machine_id, piece_index, start_ts, status)
+    SELECT p.job_card_id, p.operator_id, p.machine_id,
+           COALESCE((SELECT max(s.piece_index) FROM sessions s
+                     WHERE s.job_card_id = p.job_card_id
+                       AND s.machine_id = p.machine_id
+                       AND s.operator_id = p.operator_id
+                       AND s.start_ts >= CAST(:pieces_since AS timestamptz)), 0) + 1,
+           p.ts, 'started'
+    FROM params p
+    WHERE NOT EXISTS (SELECT 1 FROM open_session)
+    ON CONFLICT DO NOTHING
+    RETURNING id, start_ts
+),
+progress AS (
+    INSERT INTO job_card_progress AS jp (job_card_id, done, planned, total_seconds, first_start, last_stop)
+    SELECT p.job_card_id, 1,
+           COALESCE((SELECT d.planned_pieces FROM job_cards jc
+                     JOIN drawings d ON d.id = jc.drawing_id
+                     WHERE jc.id = p.job_card_id), 1),
+           c.duration_seconds, c.start_ts, p.ts
+    FROM closed c, params p
+    ON CONFLICT (job_card_id) DO UPDATE
+    SET done = jp.done + 1,
+        total_seconds = jp.total_seconds + EXCLUDED.total_seconds,
+        first_start = LEAST(jp.first_start, EXCLUDED.first_start),
+        last_stop = GREATEST(jp.last_stop, EXCLUDED.last_stop)
+    RETURNING jp.done, jp.planned
+),
+sketch AS (
+    INSERT INTO duration_sketches AS ds (drawing_id, machine_id, bucket, n)
+    SELECT jc.drawing_id, p.machine_id, {BUCKET_SQL.format("c.duration_seconds")}, 1
+    FROM closed c, params p
+    JOIN job_cards jc ON jc.id = p.job_card_id
+    ON CONFLICT (drawing_id, machine_id, bucket) DO UPDATE SET n = ds.n + 1
+)
+SELECT 'started' AS action, o.id AS session_id, o.start_ts,
+       NULL::integer AS duration_seconds, NULL::integer AS done, NULL::integer AS planned
+FROM opened o
+UNION ALL
+SELECT 'stopped', c.id, c.start_ts, c.duration_seconds, g.done, g.planned
+FROM closed c, progress g
+""")
+
+
+def _month_start(ts):
+    # partition boundary at or before ts (partitions are UTC months)
+    return ts.astimezone(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+async def toggle_session(db, job_card_id: int, operator_id: int, machine_id: int, ts: datetime.datetime = None):
+    """Run the start/stop toggle in one round trip.
+
+    Returns a dict with action, session_id, start_ts and, for stops,
+    duration_seconds/done/planned; None if a concurrent scan won the race.
+    The caller owns the transaction.
+    """
+    if ts is None:
+        ts = datetime.datetime.now(datetime.timezone.utc)
+    since = ts - datetime.timedelta(days=settings.SESSIONS_OPEN_LOOKBACK_DAYS)
+    res = await db.execute(TOGGLE_SQL, {
+        "job_card_id": job_card_id,
+        "operator_id": operator_id,
+        "machine_id": machine_id,
+        "ts": ts,
+        "since": since,
+        "pieces_since": _month_start(since),
+    })
+    row = res.mappings().first()
+    return dict(row) if row is not None else None
+
+
+# Writes the batch's new sessions, open or already closed; a piece a concurrent
+# scan already took is swallowed by the piece-owner index and not returned.
+INSERT_SQL = text("""
+INSERT INTO sessions (job_card_id, machine_id, operator_id, piece_index, start_ts, stop_ts,
+                      duration_seconds, status)
+SELECT * FROM unnest(CAST(:job_card_ids AS integer[]), CAST(:machine_ids AS integer[]),
+                     CAST(:operator_ids AS integer[]), CAST(:piece_indexes AS integer[]),
+                     CAST(:start_ts AS timestamptz[]), CAST(:stop_ts AS timestamptz[]),
+                     CAST(:durations AS integer[]), CAST(:statuses AS varchar[]))
+ON CONFLICT DO NOTHING
+RETURNING id, job_card_id, machine_id, operator_id, piece_index
+""")
+
+
+# Closes the batch's already-open sessions; only rows still open come back,
+# so a stop a live /scan got to first is not counted twice.
+CLOSE_SQL = text("""
+UPDATE sessions s
+SET stop_ts = u.stop_ts, duration_seconds = u.duration_seconds, status = 'stopped', updated_at = now()
+FROM unnest(CAST(:ids AS integer[]), CAST(:start_ts AS timestamptz[]), CAST(:stop_ts AS timestamptz[]),
+            CAST(:durations AS integer[])) AS u(id, start_ts, stop_ts, duration_seconds)
+WHERE s.id = u.id AND s.start_ts = u.start_ts AND s.status = 'started'
+  AND s.start_ts >= CAST(:since AS timestamptz)
+RETURNING s.id
+""")
+
+
+async def replay_scans(db, scans):
+    """Replay an ordered list of verified scans in the caller's transaction.
+
+    ``scans`` items are dicts with job_card_id, operator_id, machine_id and ts.
+    Open sessions and piece counters are loaded once for every owner in the
+    batch, the start/stop state machine runs in memory and the outcome is
+    written with one bulk INSERT, one UPDATE and one progress upsert. As in
+    the toggle, a start whose piece a concurrent scan already took and a stop
+    of a session closed meanwhile are skipped rather than failing the batch;
+    only what was written is counted. Returns one result dict per scan, in
+    order; done/planned on stops are the card totals after the whole batch.
+    """
+    owners = {(s["job_card_id"], s["machine_id"], s["operator_id"]) for s in scans}
+    if not owners:
+        return []
+    owner_key = tuple_(DBSession.job_card_id, DBSession.machine_id, DBSession.operator_id)
+    since = min(s["ts"] for s in scans) - datetime.timedelta(days=settings.SESSIONS_OPEN_LOOKBACK_DAYS)
+
+    open_rows = await db.execute(
+        select(DBSession.id, DBSession.job_card_id, DBSession.machine_id, DBSession.operator_id, DBSession.start_ts)
+        .where(owner_key.in_(owners), DBSession.status == literal_column("'started'"), DBSession.start_ts >= since)
+        .order_by(DBSession.start_ts)
+    )
+    piece_rows = await db.execute(
+        select(DBSession.job_card_id, DBSession.machine_id, DBSession.operator_id, func.max(DBSession.piece_index))
+        .where(owner_key.in_(owners), DBSession.start_ts >= _month_start(since))
+        .group_by(DBSession.job_card_id, DBSession.machine_id, DBSession.operator_id)
+    )
+    # latest open session wins, same as the single-scan toggle
+    open_by_owner = {(r.job_card_id, r.machine_id, r.operator_id): {"id": r.id, "start_ts": r.start_ts} for r in open_rows}
+    next_piece = {(jc, m, op): (mx or 0) + 1 for jc, m, op, mx in piece_rows}
+
+    inserts, updates, results = [], [], []
+    for s in scans:
+        owner = (s["job_card_id"], s["machine_id"], s["operator_id"])
+        ts = s["ts"]
+        current = open_by_owner.pop(owner, None)
+        if current is None:
+            row = {"job_card_id": owner[0], "machine_id": owner[1], "operator_id": owner[2],
+                   "piece_index": next_piece.get(owner, 1), "start_ts": ts,
+                   "stop_ts": None, "duration_seconds": None, "status": "started"}
+            next_piece[owner] = row["piece_index"] + 1
+            inserts.append(row)
+            open_by_owner[owner] = {"id": None, "row": row, "start_ts": ts}
+            results.append({"action": "started", "job_card_id": owner[0], "row": row, "start_ts": ts.isoformat()})
+            continue
+        duration = max(0, int((ts - current["start_ts"]).total_seconds()))
+        if current["id"] is None:
+            # started earlier in this batch, store it already closed
+            row = current["row"]
+            row.update(stop_ts=ts, duration_seconds=duration, status="stopped")
+        else:
+            row = None
+            updates.append((current["id"], current["start_ts"], ts, duration))
+        results.append({"action": "stopped", "job_card_id": owner[0], "row": row,
+                        "session_id": current["id"], "duration_seconds": duration,
+                        "stop": (owner[1], current["start_ts"], ts)})
+
+    if inserts:
+        ids = await db.execute(INSERT_SQL, {
+            "job_card_ids": [r["job_card_id"] for r in inserts], "machine_ids": [r["machine_id"] for r in inserts],
+            "operator_ids": [r["operator_id"] for r in inserts], "piece_indexes": [r["piece_index"] for r in inserts],
+            "start_ts": [r["start_ts"] for r in inserts], "stop_ts": [r["stop_ts"] for r in inserts],
+            "durations": [r["duration_seconds"] for r in inserts], "statuses": [r["status"] for r in inserts],
+        })
+        inserted = {tuple(r[1:]): r[0] for r in ids}
+        for row in inserts:
+            row["id"] = inserted.get((row["job_card_id"], row["machine_id"], row["operator_id"], row["piece_index"]))
+    closed = set()
+    if updates:
+        closed = set((await db.execute(CLOSE_SQL, {
+            "ids": [u[0] for u in updates], "start_ts": [u[1] for u in updates],
+            "stop_ts": [u[2] for u in updates], "durations": [u[3] for u in updates], "since": since,
+        })).scalars())
+
+    stops, durations = [], []
+    for r in results:
+        row, stop = r.pop("row"), r.pop("stop", None)
+        if row is not None:
+            r["session_id"] = row["id"]
+        if not (row["id"] is not None if row is not None else r["session_id"] in closed):
+            r.pop("start_ts", None)
+            r["action"], r["detail"] = "skipped", (
+                "Session already closed" if stop and row is None else "Piece already started by another scan")
+        elif stop:
+            machine_id, start_ts, stop_ts = stop
+            stops.append((r["job_card_id"], start_ts, stop_ts, r["duration_seconds"]))
+            durations.append((r["job_card_id"], machine_id, r["duration_seconds"]))
+    progress = await add_progress(db, stops)
+    await add_durations(db, durations)
+    for r in results:
+        if r["action"] == "stopped":
+            r["done"], r["planned"] = progress[r["job_card_id"]]
+    return results
+
+
+# Same counters as the toggle's progress CTE, for many cards at once.
+PROGRESS_SQL = text("""
+INSERT INTO job_card_progress AS jp (job_card_id, done, planned, total_seconds, first_start, last_stop)
+SELECT u.job_card_id, u.n, COALESCE(d.planned_pieces, 1), u.seconds, u.first_start, u.last_stop
+FROM unnest(CAST(:job_card_ids AS integer[]), CAST(:ns AS integer[]), CAST(:seconds AS bigint[]),
+            CAST(:first_starts AS timestamptz[]), CAST(:last_stops AS timestamptz[]))
+     AS u(job_card_id, n, seconds, first_start, last_stop)
+LEFT JOIN job_cards jc ON jc.id = u.job_card_id
+LEFT JOIN drawings d ON d.id = jc.drawing_id
+ON CONFLICT (job_card_id) DO UPDATE
+SET done = jp.done + EXCLUDED.done,
+    total_seconds = jp.total_seconds + EXCLUDED.total_seconds,
+    first_start = LEAST(jp.first_start, EXCLUDED.first_start),
+    last_stop = GREATEST(jp.last_stop, EXCLUDED.last_stop)
+RETURNING jp.job_card_id, jp.done, jp.planned
+""")
+
+
+async def add_progress(db, stops):
+    """Fold (job_card_id, start_ts, stop_ts, duration_seconds) stops into
+    job_card_progress. Returns {job_card_id: (done, planned)}."""
+    agg = {}
+    for job_card_id, start_ts, stop_ts, duration in stops:
+        n, seconds, first, last = agg.get(job_card_id, (0, 0, start_ts, stop_ts))
+        agg[job_card_id] = (n + 1, seconds + duration, min(first, start_ts), max(last, stop_ts))
+    if not agg:
+        return {}
+    ids = sorted(agg)  # stable lock order against concurrent batches
+    res = await db.execute(PROGRESS_SQL, {
+        "job_card_ids": ids,
+        "ns": [agg[i][0] for i in ids],
+        "seconds": [agg[i][1] for i in ids],
+        "first_starts": [agg[i][2] for i in ids],
+        "last_stops": [agg[i][3] for i in ids],
+    })
+    return {jc_id: (done, planned) for jc_id, done, planned in res}
+
+
+
+# Same sketch counters as the toggle's sketch CTE, for many stops at once.
+DURATIONS_SQL = text(f"""
+INSERT INTO duration_sketches AS ds (drawing_id, machine_id, bucket, n)
+SELECT jc.drawing_id, u.machine_id, {BUCKET_SQL.format("u.duration_seconds")} AS bucket, count(*)
+FROM unnest(CAST(:job_card_ids AS integer[]), CAST(:machine_ids AS integer[]), CAST(:durations AS integer[]))
+     AS u(job_card_id, machine_id, duration_seconds)
+JOIN job_cards jc ON jc.id = u.job_card_id
+GROUP BY 1, 2, 3
+ORDER BY 1, 2, 3
+ON CONFLICT (drawing_id, machine_id, bucket) DO UPDATE SET n = ds.n + EXCLUDED.n
+""")
+
+
+async def add_durations(db, durations):
+    """Count (job_card_id, machine_id, duration_seconds) stops into the
+    drawings' piece-time sketches."""
+    if not durations:
+        return
+    await db.execute(DURATIONS_SQL, {
+        "job_card_ids": [d[0] for d in durations],
+        "machine_ids": [d[1] for d in durations],
+        "durations": [d[2] for d in durations],
+    })
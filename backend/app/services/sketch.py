@@ -0,0 +1,97 @@
+"""Mergeable piece-time sketches per drawing and machine.
+
+A DDSketch-style histogram: a duration x lands in bucket ceil(log_g(x)) with
+g = (1 + a) / (1 - a), and every bucket is read back as the value within
+relative error a of all durations in it. Buckets are plain counters in
+duration_sketches, bumped by the same statement that stops a session, so
+concurrent stops never read-modify-write a blob; merging machines (or
+drawings) is summing counts per bucket. A drawing has at most a few hundred
+buckets per machine whatever the number of pieces, so an estimate never
+touches sessions.
+"""
+import datetime, math
+from sqlalchemy import text
+
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+_LN_GAMMA = math.log(GAMMA)
+
+# the same bucket index in SQL; durations under a second count as one second
+BUCKET_SQL = f"CAST(CEIL(LN(GREATEST({{}}, 1)) / {_LN_GAMMA!r}) AS integer)"
+
+
+def bucket(seconds):
+    return math.ceil(math.log(max(seconds, 1)) / _LN_GAMMA)
+
+
+def value(index):
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def quantile(counts, q):
+    """Value at quantile ``q`` of [(bucket, count)] sorted by bucket."""
+    total = sum(n for _, n in counts)
+    if not total:
+        return None
+    rank, seen = q * (total - 1), 0
+    for index, n in counts:
+        seen += n
+        if seen > rank:
+            return value(index)
+    return value(counts[-1][0])
+
+
+SKETCH_SQL = """
+SELECT bucket, CAST(sum(n) AS bigint) AS n
+FROM duration_sketches
+WHERE drawing_id = :drawing_id {where}
+GROUP BY bucket
+ORDER BY bucket
+"""
+
+# Progress of one card, or of every card of a drawing, and its drawing.
+PROGRESS_SQL = """
+SELECT jc.drawing_id, count(*) AS cards, sum(jp.done) AS done,
+       sum(greatest(jp.planned - jp.done, 0)) AS remaining, sum(jp.planned) AS planned,
+       min(jp.first_start) AS first_start, max(jp.last_stop) AS last_stop
+FROM job_cards jc
+JOIN job_card_progress jp ON jp.job_card_id = jc.id
+WHERE {where}
+GROUP BY jc.drawing_id
+"""
+
+
+async def piece_times(db, drawing_id, machine_id=None):
+    """Median and p90 piece seconds of a drawing, all machines merged unless
+    ``machine_id`` is given, and the number of pieces behind them."""
+    params, where = {"drawing_id": drawing_id}, ""
+    if machine_id is not None:
+        params["machine_id"], where = machine_id, "AND machine_id = :machine_id"
+    counts = [(b, n) for b, n in await db.execute(text(SKETCH_SQL.format(where=where)), params)]
+    median, p90 = quantile(counts, 0.5), quantile(counts, 0.9)
+    return {
+        "pieces_measured": sum(n for _, n in counts),
+        "median_seconds": round(median, 1) if median is not None else None,
+        "p90_seconds": round(p90, 1) if p90 is not None else None,
+    }
+
+
+async def progress(db, job_card_id=None, drawing_id=None, machine_id=None, now=None):
+    """Done/planned pieces and the ETA (remaining pieces x median piece time)
+    of a job card or a whole drawing; None if it does not exist."""
+    if job_card_id is not None:
+        where, params = "jc.id = :id", {"id": job_card_id}
+    else:
+        where, params = "jc.drawing_id = :id", {"id": drawing_id}
+    row = (await db.execute(text(PROGRESS_SQL.format(where=where)), params)).mappings().first()
+    if row is None:
+        return None
+    out = dict(row)
+    out.update(await piece_times(db, row["drawing_id"], machine_id))
+    eta = None
+    if out["median_seconds"] is not None:
+        eta = round(row["remaining"] * out["median_seconds"])
+    out["eta_seconds"] = eta
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    out["eta"] = now + datetime.timedelta(seconds=eta) if eta is not None else None
+    return out
@@ -0,0 +1,77 @@
+"""Sweep sessions left open because the stop scan was forgotten.
+
+A started session is stale once it has been open longer than its drawing's
+planned_time_per_piece x SESSION_STALE_FACTOR (never less than
+SESSION_STALE_MIN_SECONDS; SESSION_STALE_DEFAULT_SECONDS when the drawing has
+no planned time). One UPDATE ... RETURNING handles every stale session:
+"cancel" closes them as cancelled, so the next scan on that card starts a
+fresh piece instead of stopping this one with a duration of days; "mark"
+only flags them in meta. Either way each session is reported once.
+"""
+import datetime, logging
+from sqlalchemy import text
+from app.core.config import settings
+
+log = logging.getLogger(__name__)
+
+# the cheapest threshold first bounds the index scan on open sessions
+SWEEP_SQL = """
+WITH stale AS (
+    SELECT s.id, s.start_ts
+    FROM sessions s
+    LEFT JOIN job_cards jc ON jc.id = s.job_card_id
+    LEFT JOIN drawings d ON d.id = jc.drawing_id
+    WHERE s.status = 'started'
+      AND s.start_ts < CAST(:now AS timestamptz) - make_interval(secs => CAST(:min_seconds AS double precision))
+      {where}
+      AND s.start_ts < CAST(:now AS timestamptz) - make_interval(secs => CASE
+              WHEN coalesce(d.planned_time_per_piece, 0) > 0
+              THEN greatest(d.planned_time_per_piece * CAST(:factor AS double precision), CAST(:min_seconds AS double precision))
+              ELSE CAST(:default_seconds AS double precision) END)
+    ORDER BY s.start_ts
+    LIMIT :limit
+)
+UPDATE sessions s
+SET {set}meta = CAST(CASE WHEN json_typeof(s.meta) = 'object' THEN CAST(s.meta AS jsonb) ELSE '{{}}' END
+                   || jsonb_build_object('stale', CAST(:now AS timestamptz)) AS json),
+    updated_at = now()
+FROM stale
+WHERE s.id = stale.id AND s.start_ts = stale.start_ts AND s.status = 'started'
+RETURNING s.id, s.job_card_id, s.machine_id, s.operator_id, s.start_ts
+"""
+# mode -> (extra SET, extra WHERE)
+_MODES = {
+    "cancel": ("status = 'cancelled', stop_ts = CAST(:now AS timestamptz), ", ""),
+    "mark": ("", "AND (s.meta IS NULL OR s.meta ->> 'stale' IS NULL)"),
+}
+
+
+async def sweep(conn, mode=None, now=None, limit=None):
+    """Cancel or mark stale open sessions in the caller's transaction;
+    returns the affected rows."""
+    mode = mode or settings.SESSION_STALE_MODE
+    if mode not in _MODES:
+        raise ValueError(f"unknown SESSION_STALE_MODE {mode!r}; use one of {', '.join(_MODES)}")
+    set_, where = _MODES[mode]
+    rows = await conn.execute(text(SWEEP_SQL.format(set=set_, where=where)), {
+        "now": now or datetime.datetime.now(datetime.timezone.utc),
+        "factor": settings.SESSION_STALE_FACTOR,
+        "min_seconds": settings.SESSION_STALE_MIN_SECONDS,
+        "default_seconds": settings.SESSION_STALE_DEFAULT_SECONDS,
+        "limit": limit or settings.SESSION_STALE_BATCH,
+    })
+    return [dict(r) for r in rows.mappings()]
+
+
+def alert_text(rows, mode, now=None, max_lines=20):
+    """One message for a whole sweep."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    verb = "cancelled" if mode == "cancel" else "still open"
+    lines = [f"{len(rows)} forgotten session(s) {verb}:"]
+    for r in rows[:max_lines]:
+        hours = (now - r["start_ts"]).total_seconds() / 3600
+        lines.append(f"- session {r['id']}: card {r['job_card_id']}, machine {r['machine_id']}, "
+                     f"operator {r['operator_id']}, open {hours:.1f} h")
+    if len(rows) > max_lines:
+        lines.append(f"... and {len(rows) - max_lines} more")
+    return "\n".join(lines)
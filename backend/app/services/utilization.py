@@ -0,0 +1,102 @@
+"""Machine utilization: busy time per bucket from overlapping sessions.
+
+Several operators can run pieces on one machine at once, so sessions are
+merged into busy intervals with a sweep over rows streamed in
+(machine_id, start_ts) order. Only the current interval and one row of
+bucket totals per machine are held in memory, whatever the range.
+"""
+import bisect, datetime, zoneinfo
+from sqlalchemy import text
+from app.core.config import settings
+
+BUCKETS = ("hour", "shift", "day")
+
+SESSIONS_SQL = """
+SELECT machine_id, start_ts, coalesce(stop_ts, :now) AS stop_ts
+FROM sessions
+WHERE start_ts >= :since AND start_ts < :end
+  AND coalesce(stop_ts, :now) > :start
+  AND CAST(status AS text) IN ('started', 'stopped')
+  {where}
+ORDER BY machine_id, start_ts
+"""
+
+
+def _shift_starts():
+    return [datetime.time.fromisoformat(t.strip()) for t in settings.SHIFT_STARTS.split(",")]
+
+
+def edges(start, end, bucket, tz):
+    """Bucket boundaries in UTC from ``start`` to ``end``; hours, days and
+    shifts start on the local clock of ``tz``, the outer buckets are clipped."""
+    zone = zoneinfo.ZoneInfo(tz)
+    if bucket == "hour":
+        # steps of 3600 s from a local full hour stay on local full hours,
+        # DST changes included
+        first = start.astimezone(zone).replace(minute=0, second=0, microsecond=0).astimezone(datetime.timezone.utc)
+        inner = [first + datetime.timedelta(hours=i)
+                 for i in range(1, int((end - first).total_seconds() // 3600) + 1)]
+    else:
+        times = _shift_starts() if bucket == "shift" else [datetime.time(0)]
+        day = start.astimezone(zone).date() - datetime.timedelta(days=1)
+        last = end.astimezone(zone).date()
+        inner = []
+        while day <= last:
+            inner += [datetime.datetime.combine(day, t, zone).astimezone(datetime.timezone.utc) for t in times]
+            day += datetime.timedelta(days=1)
+    return [start] + sorted(t for t in inner if start < t < end) + [end]
+
+
+def add_busy(busy, bounds, s, e):
+    """Spread [s, e) over the buckets; ``bounds`` are the edges as epoch seconds."""
+    s, e = max(s, bounds[0]), min(e, bounds[-1])
+    i = bisect.bisect_right(bounds, s) - 1
+    while s < e:
+        hi = min(e, bounds[i + 1])
+        busy[i] += hi - s
+        s = hi
+        i += 1
+
+
+def timeline(bounds, busy):
+    return [
+        {"start": datetime.datetime.fromtimestamp(lo, datetime.timezone.utc),
+         "end": datetime.datetime.fromtimestamp(hi, datetime.timezone.utc),
+         "busy_seconds": round(b, 1), "busy_ratio": round(b / (hi - lo), 4)}
+        for lo, hi, b in zip(bounds, bounds[1:], busy)
+    ]
+
+
+async def utilization(db, start, end, bucket, tz, machine_id=None, now=None):
+    """{machine_id: [bucket, ...]} for every machine, or just ``machine_id``.
+    Open sessions count as busy until ``now``."""
+    now = min(now or datetime.datetime.now(datetime.timezone.utc), end)
+    bounds = [t.timestamp() for t in edges(start, end, bucket, tz)]
+    params = {"start": start, "end": end, "now": now,
+              "since": start - datetime.timedelta(days=settings.SESSIONS_OPEN_LOOKBACK_DAYS)}
+    where, machines_sql = "", "SELECT id FROM machines ORDER BY id"
+    if machine_id is not None:
+        params["machine_id"] = machine_id
+        where, machines_sql = "AND machine_id = :machine_id", "SELECT id FROM machines WHERE id = :machine_id"
+    busy = {m: [0.0] * (len(bounds) - 1) for (m,) in await db.execute(text(machines_sql), params)}
+
+    # rows arrive ordered by (machine, start): extend the current busy
+    # interval while sessions overlap it, book it once a gap or the next
+    # machine shows up
+    machine, cur = None, None
+    result = await db.stream(text(SESSIONS_SQL.format(where=where)).execution_options(yield_per=2000), params)
+    async for part in result.partitions(2000):
+        for m, s, e in part:
+            s, e = s.timestamp(), e.timestamp()
+            if m == machine and s <= cur[1]:
+                cur[1] = max(cur[1], e)
+                continue
+            if cur:
+                add_busy(busy[machine], bounds, *cur)
+            if m not in busy:
+                busy[m] = [0.0] * (len(bounds) - 1)
+            machine, cur = m, [s, e]
+    if cur:
+        add_busy(busy[machine], bounds, *cur)
+    await result.close()
+    return {m: timeline(bounds, b) for m, b in busy.items()}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Scan-path load test: N machines x M operators scanning start/stop against the API.
+
+Runs against a live backend (--url) or, by default, the in-process ASGI app.
+Machines, operators and one job card per machine are created first (through
+the database and the API), then every (machine, operator) pair runs
+start/stop cycles as fast as allowed. Prints throughput, p50/p95/p99 latency
+and error rates, and writes JSON results that --compare can diff later.
+
+    python scripts/loadtest.py --machines 40 --operators 5 --cycles 20 --out run.json
+    python scripts/loadtest.py --url http://localhost:8000 --compare run.json
+"""
+import argparse, asyncio, datetime, json, math, random, subprocess, time
+import httpx
+from app.db.session import AsyncSessionLocal, engine
+from app.db.models import User, Machine
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[k]
+
+def summarize(samples, elapsed):
+    lat = [s["ms"] for s in samples]
+    ok = [s for s in samples if s["status"] == 200]
+    out = {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+        "p50_ms": percentile(lat, 50),
+        "p95_ms": percentile(lat, 95),
+        "p99_ms": percentile(lat, 99),
+        "max_ms": max(lat) if lat else None,
+    }
+    queries = [s["queries"] for s in ok if s["queries"] is not None]
+    if queries:
+        out["db_queries_per_scan"] = round(sum(queries) / len(queries), 2)
+        out["db_queries_per_scan_max"] = max(queries)
+    return out
+
+async def seed(ac, machines, operators, cycles):
+    tag = f"lt{int(time.time())}"
+    async with AsyncSessionLocal() as s:
+        ms = [Machine(name=f"{tag}-m{i}") for i in range(machines)]
+        us = [User(username=f"{tag}-op{i}") for i in range(operators)]
+        s.add_all(ms + us)
+        await s.commit()
+        machine_ids, operator_ids = [m.id for m in ms], [u.id for u in us]
+    job_id = (await ac.post("/api/v1/jobs", json={"name": f"{tag} load test"})).json()["id"]
+    drawing_id = (await ac.post("/api/v1/drawings", json={
+        "job_id": job_id, "drawing_number": f"{tag}-D", "planned_time_per_piece": 60,
+        "planned_pieces": cycles * operators,
+    })).json()["id"]
+    tokens = {}
+    for m in machine_ids:
+        r = await ac.post("/api/v1/jobcards", json={"drawing_id": drawing_id, "card_number": f"{tag}-{m}"})
+        tokens[m] = r.json()["qr_payload"]
+    return machine_ids, operator_ids, tokens
+
+async def scanner(ac, machine_id, operator_id, token, args, samples):
+    # spread the first scans over the ramp, like a shift change
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    body = {"operator_id": operator_id, "machine_id": machine_id, "qr_payload": token}
+    for _ in range(args.cycles * 2):
+        queries = None
+        t0 = time.perf_counter()
+        try:
+            r = await ac.post("/api/v1/scan", json=body)
+            status = r.status_code
+            action = r.json().get("action", "error") if status == 200 else "error"
+            # counted server-side by DBRoute
+            if "X-DB-Queries" in r.headers:
+                queries = int(r.headers["X-DB-Queries"])
+        except httpx.HTTPError as e:
+            status, action = type(e).__name__, "error"
+        ms = round((time.perf_counter() - t0) * 1000, 2)
+        samples.append({"action": action, "status": status, "ms": ms, "queries": queries})
+        if args.think:
+            await asyncio.sleep(random.expovariate(1 / args.think))
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_compare(result, baseline):
+    print(f"\ncompared with {baseline['git_rev']} ({baseline['started_at']}):")
+    for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate", "db_queries_per_scan"):
+        a, b = baseline["total"].get(key), result["total"].get(key)
+        if a is not None and b is not None:
+            delta = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            print(f"  {key:22} {a:>10} -> {b:>10}  {delta}")
+
+async def run(args):
+    if args.url:
+        ac = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from app.main import app
+        ac = httpx.AsyncClient(app=app, base_url="http://loadtest", timeout=args.timeout)
+    async with ac:
+        machine_ids, operator_ids, tokens = await seed(ac, args.machines, args.operators, args.cycles)
+        samples = []
+        started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        t0 = time.perf_counter()
+        await asyncio.gather(*[
+            scanner(ac, m, op, tokens[m], args, samples) for m in machine_ids for op in operator_ids
+        ])
+        elapsed = time.perf_counter() - t0
+    await engine.dispose()
+
+    errors = {}
+    for s in samples:
+        if s["status"] != 200:
+            errors[str(s["status"])] = errors.get(str(s["status"]), 0) + 1
+    result = {
+        "started_at": started_at,
+        "git_rev": git_rev(),
+        "target": args.url or "in-process",
+        "config": {k: getattr(args, k) for k in ("machines", "operators", "cycles", "think", "ramp")},
+        "elapsed_s": round(elapsed, 3),
+        "total": summarize(samples, elapsed),
+        "by_action": {a: summarize([s for s in samples if s["action"] == a], elapsed) for a in ("started", "stopped")},
+        "errors": errors,
+    }
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_compare(result, json.load(f))
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--url", help="backend base URL; default is the in-process ASGI app")
+    p.add_argument("--machines", type=int, default=20)
+    p.add_argument("--operators", type=int, default=5, help="operators per machine")
+    p.add_argument("--cycles", type=int, default=10, help="start/stop cycles per operator")
+    p.add_argument("--think", type=float, default=0.0, help="mean seconds between scans")
+    p.add_argument("--ramp", type=float, default=0.0, help="spread first scans over this many seconds")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--out", help="write JSON results here")
+    p.add_argument("--compare", help="earlier JSON results to diff against")
+    asyncio.run(run(p.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,20 @@ export default function Admin(){
   const [machines, setMachines] = useState([]);
   const [users, setUsers] = useState([]);
   const [name, setName] = useState('');
+  const [feed, setFeed] = useState([]);
   useEffect(()=>{ load(); },[]);
+  useEffect(()=>{
+    // live floor events instead of polling
+    const es = new EventSource('/api/v1/events');
+    es.onmessage = e => setFeed(f => [JSON.parse(e.data), ...f].slice(0, 20));
+    return () => es.close();
+  },[]);
   async function load(){
-    const j = await fetchAuth('/api/v1/jobs/list').catch(()=>[]);
-    const m = await fetchAuth('/api/v1/machines/list').catch(()=>[]);
-    setJobs(j || []);
-    setMachines(m || []);
+    // newest first; the lists are paginated (next_cursor), one page is enough here
+    const j = await fetchAuth('/api/v1/jobs/list?sort=-id&limit=200').catch(()=>null);
+    const m = await fetchAuth('/api/v1/machines/list?sort=name&limit=200').catch(()=>null);
+    setJobs((j && j.items) || []);
+    setMachines((m && m.items) || []);
   }
   async function createJob(){
     const res = await fetchAuth('/api/v1/jobs', {method:'POST', body: JSON.stringify({name, customer:''})});
@@ -32,6 +40,10 @@ export default function Admin(){
         <button onClick={createJob}>Create</button>
         <ul>{jobs.map(j=> <li key={j.id}>{j.name} (id:{j.id})</li>)}</ul>
       </div>
+      <div>
+        <h4>Live</h4>
+        <ul>{feed.map((e,i)=> <li key={i}>{e.type} card:{e.job_card_id} machine:{e.machine_id} operator:{e.operator_id}</li>)}</ul>
+      </div>
     </div>
   );
 }
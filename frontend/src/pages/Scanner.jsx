@@ -1,12 +1,98 @@
 import React, { useEffect, useRef, useState } from "react";
 import { BrowserMultiFormatReader } from "@zxing/browser";
 
+const QUEUE_KEY = 'scanQueue';
+// {key, count} of the batch being replayed, so a retry after a lost answer reuses its key
+const BATCH_KEY = 'scanBatch';
+const BATCH_MAX = 500;
+// batches the backend refused, kept with the status for someone to look at
+const REJECTED_KEY = 'scanRejected';
+
+function loadQueue() {
+  return JSON.parse(localStorage.getItem(QUEUE_KEY) || '[]');
+}
+
+function enqueue(scan) {
+  localStorage.setItem(QUEUE_KEY, JSON.stringify([...loadQueue(), scan]));
+}
+
+function park(scans, status) {
+  const rejected = JSON.parse(localStorage.getItem(REJECTED_KEY) || '[]');
+  localStorage.setItem(REJECTED_KEY, JSON.stringify([...rejected, {status, scans}]));
+}
+
+function authHeaders() {
+  const token = localStorage.getItem('token');
+  return {'Content-Type':'application/json', Authorization: `Bearer ${token}`};
+}
+
+// replay scans buffered while offline, oldest first; each keeps the
+// Idempotency-Key it was first sent with, so one /scan already applied is not toggled again
+async function flushQueue() {
+  while (loadQueue().length) {
+    const queue = loadQueue();
+    let batch = JSON.parse(localStorage.getItem(BATCH_KEY) || 'null');
+    if (!batch || batch.count > queue.length) {
+      batch = {key: crypto.randomUUID(), count: Math.min(queue.length, BATCH_MAX)};
+      localStorage.setItem(BATCH_KEY, JSON.stringify(batch));
+    }
+    const scans = queue.slice(0, batch.count);
+    const r = await fetch('/api/v1/scan/batch', {
+      method: 'POST', headers: {...authHeaders(), 'Idempotency-Key': batch.key}, body: JSON.stringify({ scans })
+    });
+    // network errors and 5xx retry later; 409 is this batch's key still being
+    // applied, so a retry replays it. Any other 4xx would fail the same way
+    // again and block the queue, so the batch is parked and the queue moves on
+    if (r.status >= 500 || r.status === 409) throw new Error(r.status);
+    if (r.ok) {
+      console.log(await r.json());
+    } else {
+      console.error('scan batch rejected', r.status, await r.text());
+      park(scans, r.status);
+    }
+    localStorage.setItem(QUEUE_KEY, JSON.stringify(loadQueue().slice(scans.length)));
+    localStorage.removeItem(BATCH_KEY);
+  }
+}
+
+async function sendScan(scan) {
+  const key = crypto.randomUUID(), ts = new Date().toISOString();
+  // while older scans wait in the queue this one goes behind them, keeping scan order
+  if (!loadQueue().length) {
+    try {
+      // the key lets the backend recognise a retried POST of this same scan
+      const r = await fetch('/api/v1/scan', {method: 'POST', headers: {...authHeaders(), 'Idempotency-Key': key}, body: JSON.stringify(scan)});
+      console.log(await r.json());
+      return;
+    } catch (err) {
+      // network down or answer lost: keep the scan with its client timestamp for later replay
+      console.error(err);
+    }
+  }
+  enqueue({...scan, ts, idempotency_key: key});
+  await flushQueue();
+}
+
+// live scans and queue flushes run one at a time, in order
+let pending = Promise.resolve();
+function serially(task) {
+  pending = pending.then(task).catch(console.error);
+  return pending;
+}
+
 export default function Scanner() {
   const videoRef = useRef();
   const [result, setResult] = useState(null);
   const [operatorId, setOperatorId] = useState(1);
   const [machineId, setMachineId] = useState(1);
 
+  useEffect(() => {
+    const flush = () => serially(flushQueue);
+    flush();
+    window.addEventListener('online', flush);
+    return () => window.removeEventListener('online', flush);
+  }, []);
+
   useEffect(() => {
     const codeReader = new BrowserMultiFormatReader();
     let selectedDeviceId;
@@ -19,12 +105,8 @@ export default function Scanner() {
           codeReader.decodeFromVideoDevice(selectedDeviceId, videoRef.current, (result, err) => {
             if (result) {
               setResult(result.getText());
-              const token = localStorage.getItem('token');
-              fetch('/api/v1/scan', {
-                method: 'POST',
-                headers: {'Content-Type':'application/json', Authorization: `Bearer ${token}`},
-                body: JSON.stringify({ operator_id: operatorId, machine_id: machineId, qr_payload: result.getText() })
-              }).then(r=>r.json()).then(console.log).catch(console.error);
+              const scan = { operator_id: operatorId, machine_id: machineId, qr_payload: result.getText() };
+              serially(() => sendScan(scan));
             }
           });
         }
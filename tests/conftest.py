@@ -0,0 +1,12 @@
+import pytest_asyncio
+from app.db import session
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def _fresh_pools():
+    # every test runs on its own event loop and pooled asyncpg connections
+    # belong to the loop that opened them
+    yield
+    await session.engine.dispose()
+    if session.read_engine is not None:
+        await session.read_engine.dispose()
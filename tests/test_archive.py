@@ -0,0 +1,56 @@
+import datetime, json, pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal, engine
+from app.main import app
+from app.services import archive
+
+@pytest.mark.asyncio
+async def test_archive_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    async with AsyncSessionLocal() as s:
+        op, m = User(username="op-arch"), Machine(name="M-arch")
+        s.add_all([op, m])
+        await s.commit()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Tst archive"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-arch","planned_pieces":5})
+        r3 = await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":"C-arch"})
+        card = r3.json()
+        # two closed pieces and one left open, in a month no other test writes to
+        scans = [{"operator_id":op.id,"machine_id":m.id,"qr_payload":card["qr_payload"],"ts":f"2023-09-0{d}T08:00:00+00:00"} for d in range(1, 6)]
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": scans})).status_code==200
+
+        async with engine.begin() as conn:
+            tmp, rows = await archive.archive_month(conn, datetime.date(2023, 9, 1))
+        assert rows==2
+        archive.publish(tmp)
+        assert archive.archived_months()==[datetime.date(2023, 9, 1)]
+        assert len(list(tmp_path.glob("sessions/month=2023-09/*.csv.gz.sha256")))==1
+        async with engine.connect() as conn:
+            left = await conn.execute(text("SELECT CAST(status AS text) FROM sessions WHERE job_card_id = :id"), {"id": card["id"]})
+            assert [s for (s,) in left]==["started"]
+
+        r4 = await ac.get("/api/v1/history/sessions", params={"start":"2023-09-01T00:00:00Z","end":"2023-10-01T00:00:00Z","machine_id":m.id})
+        assert r4.status_code==200
+        rows = [json.loads(line) for line in r4.text.splitlines()]
+        assert sorted(x["status"] for x in rows)==["started","stopped","stopped"]
+        assert {(x["card_number"], x["machine"], x["operator"]) for x in rows}=={("C-arch", "M-arch", "op-arch")}
+
+@pytest.mark.asyncio
+async def test_recover_leftover_parts(tmp_path, monkeypatch):
+    import gzip
+    monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+    month = tmp_path / "sessions" / "month=2023-05"
+    month.mkdir(parents=True)
+    async with engine.begin() as conn:
+        live = await conn.scalar(text("INSERT INTO sessions (piece_index, start_ts, status) VALUES (1, '2023-05-10T08:00:00+00:00', 'stopped') RETURNING id"))
+        # a delete that committed (ids gone) and one that did not (id still live)
+        for name, ids in (("part-1.csv.gz.tmp", [10**9]), ("part-2.csv.gz.tmp", [live])):
+            with gzip.open(month / name, "wt") as f:
+                f.write("id\n" + "".join(f"{i}\n" for i in ids))
+        await archive.recover(conn)
+        await conn.execute(text("DELETE FROM sessions WHERE id = :id"), {"id": live})
+    assert sorted(p.name for p in month.iterdir())==["part-1.csv.gz", "part-1.csv.gz.sha256"]
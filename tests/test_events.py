@@ -0,0 +1,12 @@
+from starlette.testclient import TestClient
+from app.main import app
+from app.services import events
+
+def test_socket_unsubscribes_when_client_closes():
+    client = TestClient(app)
+    with client.websocket_connect("/api/v1/events/ws") as ws:
+        assert len(events._subscribers)==1
+        events.publish({"type":"ping"})
+        assert ws.receive_json()=={"type":"ping"}
+    # closing with no events pending must not leave the subscriber behind
+    assert not events._subscribers
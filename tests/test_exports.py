@@ -0,0 +1,34 @@
+import csv, gzip, io, zipfile, pytest
+from httpx import AsyncClient
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal
+from app.main import app
+
+@pytest.mark.asyncio
+async def test_export_sessions_csv_and_xlsx():
+    async with AsyncSessionLocal() as s:
+        op, m = User(username="op-exp"), Machine(name="M-exp")
+        s.add_all([op, m])
+        await s.commit()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Export <job>"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-exp","planned_pieces":5})
+        r3 = await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":"C-exp"})
+        card = r3.json()
+        scans = [{"operator_id":op.id,"machine_id":m.id,"qr_payload":card["qr_payload"],"ts":f"2025-06-0{d}T08:00:00+00:00"} for d in range(1, 5)]
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": scans})).status_code==200
+        params = {"start":"2025-06-01T00:00:00Z","end":"2025-07-01T00:00:00Z","job_card_id":card["id"]}
+
+        r = await ac.get("/api/v1/exports/sessions", params={**params, "gzip":"true"})
+        assert r.status_code==200 and r.headers["content-type"]=="application/gzip"
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(r.content).decode())))
+        assert len(rows)==2 and {x["job"] for x in rows}=={"Export <job>"}
+        assert {(x["machine_id"], x["machine"], x["operator"], x["card_number"]) for x in rows}=={(str(m.id), "M-exp", "op-exp", "C-exp")}
+        assert rows[0]["stop_ts"].startswith("2025-06-02")
+
+        r = await ac.get("/api/v1/exports/sessions", params={**params, "format":"xlsx"})
+        assert r.status_code==200
+        z = zipfile.ZipFile(io.BytesIO(r.content))
+        assert z.testzip() is None and "xl/workbook.xml" in z.namelist()
+        sheet = z.read("xl/worksheets/sheet1.xml").decode()
+        assert sheet.count("<row ")==3 and "Export &lt;job&gt;" in sheet
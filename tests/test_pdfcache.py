@@ -0,0 +1,41 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+from app.core.config import settings
+from app.db.session import engine
+from app.main import app
+from app.services import pdfcache
+
+@pytest.mark.asyncio
+async def test_jobcard_pdf_etag(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PDF_CACHE_DIR", str(tmp_path))
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Pdf cache"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-pc","planned_pieces":5})
+        card = (await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":"C-pc"})).json()
+        r = await ac.get(f"/api/v1/jobcard/{card['id']}/pdf")
+        assert r.status_code==200 and r.content.startswith(b"%PDF")
+        etag = r.headers["etag"]
+        k = etag.strip('"')
+        assert list(tmp_path.glob("*/*.pdf"))==[tmp_path / k[:2] / f"{k}.pdf"]
+        r = await ac.get(f"/api/v1/jobcard/{card['id']}/pdf", headers={"If-None-Match": f'"x", {etag}'})
+        assert r.status_code==304 and r.headers["etag"]==etag and not r.content
+        r = await ac.get(f"/api/v1/jobcard/{card['id']}/pdf", headers={"If-None-Match": '"stale"'})
+        assert r.status_code==200 and r.headers["etag"]==etag
+        # evicted by another process between the lookup and the open: rendered again
+        get_or_create = pdfcache.get_or_create
+        def evicted_meanwhile(*args):
+            p = get_or_create(*args)
+            monkeypatch.setattr(pdfcache, "get_or_create", get_or_create)
+            p.unlink()
+            return p
+        monkeypatch.setattr(pdfcache, "get_or_create", evicted_meanwhile)
+        r = await ac.get(f"/api/v1/jobcard/{card['id']}/pdf")
+        assert r.status_code==200 and r.content.startswith(b"%PDF") and r.headers["etag"]==etag
+        assert int(r.headers["content-length"])==len(r.content)
+        # a card without its drawing is a 404, not a 500
+        async with engine.begin() as conn:
+            orphan = await conn.scalar(text("INSERT INTO job_cards (card_number) VALUES ('C-orphan') RETURNING id"))
+        assert (await ac.get(f"/api/v1/jobcard/{orphan}/pdf")).status_code==404
+    assert pdfcache.evict(max_bytes=0)==1
+    assert not list(tmp_path.glob("*/*.pdf"))
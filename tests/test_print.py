@@ -0,0 +1,17 @@
+import pytest
+from httpx import AsyncClient
+from app.main import app
+
+@pytest.mark.asyncio
+async def test_print_jobcards_one_pdf():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Print"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-pr","planned_pieces":5})
+        ids = [(await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":f"C-pr{i}"})).json()["id"] for i in range(3)]
+        r = await ac.post("/api/v1/jobcards/print", json={"ids": ids[:2]})
+        assert r.status_code==200 and r.headers["content-type"]=="application/pdf"
+        assert r.content.startswith(b"%PDF") and r.content.count(b"/Type /Page\n")==2
+        r = await ac.post("/api/v1/jobcards/print", json={"drawing_id": r2.json()["id"]})
+        assert r.content.count(b"/Type /Page\n")==3
+        assert (await ac.post("/api/v1/jobcards/print", json={})).status_code==400
+        assert (await ac.post("/api/v1/jobcards/print", json={"ids": [999999]})).status_code==404
@@ -0,0 +1,29 @@
+from app.core.config import settings
+from app.services import qr
+from app.services.cache import LRUCache, MISSING
+
+def test_lru_eviction_and_ttl():
+    c = LRUCache(maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    c.set("c", 3)  # evicts b, a was used more recently
+    assert c.get("b") is MISSING
+    assert c.stats()["size"] == 2
+    c.set("neg", None, ttl=-1)
+    assert c.get("neg") is MISSING
+
+def test_verify_is_cached_and_secret_rotation_invalidates(monkeypatch):
+    token = qr.build_qr_payload(42)
+    before = qr.qr_cache_stats()
+    assert qr.verify_qr_payload(token)["job_card_id"] == 42
+    assert qr.verify_qr_payload(token)["job_card_id"] == 42
+    after = qr.qr_cache_stats()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] + 1
+    assert qr.verify_qr_payload("garbage") is None
+    assert qr.verify_qr_payload("garbage") is None
+    assert qr.qr_cache_stats()["hits"] == after["hits"] + 1
+
+    monkeypatch.setattr(settings, "QR_SECRET", settings.QR_SECRET + "-rotated")
+    assert qr.verify_qr_payload(token) is None
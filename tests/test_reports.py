@@ -0,0 +1,88 @@
+import pytest
+from httpx import AsyncClient
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal
+from app.main import app
+
+async def _operator_and_machine(name):
+    async with AsyncSessionLocal() as s:
+        op, m = User(username=f"op-{name}"), Machine(name=f"M-{name}")
+        s.add_all([op, m])
+        await s.commit()
+    return op.id, m.id
+
+async def _card(ac, name, planned_time):
+    r = await ac.post("/api/v1/jobs", json={"name":name})
+    r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":name,"planned_time_per_piece":planned_time,"planned_pieces":10})
+    r3 = await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":name})
+    return r2.json()["id"], r3.json()["qr_payload"]
+
+@pytest.mark.asyncio
+async def test_efficiency_report():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        op, m = await _operator_and_machine("eff")
+        drawing_id, token = await _card(ac, "Eff", 60)
+        # pieces of 30, 60 and 90 seconds
+        scans = []
+        for i, secs in enumerate((30, 60, 90)):
+            scans.append({"operator_id":op,"machine_id":m,"qr_payload":token,"ts":f"2026-03-0{i+1}T08:00:00+00:00"})
+            scans.append({"operator_id":op,"machine_id":m,"qr_payload":token,"ts":f"2026-03-0{i+1}T08:{secs // 60:02d}:{secs % 60:02d}+00:00"})
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": scans})).status_code==200
+        params = {"start":"2026-03-01T00:00:00Z","end":"2026-04-01T00:00:00Z","drawing_id":drawing_id}
+        r = await ac.get("/api/v1/reports/efficiency", params={**params, "group_by":"drawing"})
+        assert r.status_code==200
+        [row] = r.json()["rows"]
+        assert row["pieces"]==3
+        assert row["mean_seconds"]==60 and row["median_seconds"]==60 and row["p90_seconds"]==84
+        assert row["planned_seconds"]==60 and row["efficiency"]==1
+        r = await ac.get("/api/v1/reports/efficiency", params={**params, "group_by":"machine,day"})
+        assert [x["day"] for x in r.json()["rows"]]==["2026-03-01","2026-03-02","2026-03-03"]
+        r = await ac.get("/api/v1/reports/efficiency", params={**params, "group_by":"shift"})
+        assert r.status_code==400
+
+@pytest.mark.asyncio
+async def test_utilization_merges_overlaps():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        op, m = await _operator_and_machine("util")
+        _, a = await _card(ac, "UtilA", 60)
+        _, b = await _card(ac, "UtilB", 60)
+        # A 08:00-08:30 and B 08:15-09:00 overlap: one busy hour
+        scans = [{"operator_id":op,"machine_id":m,"qr_payload":token,"ts":f"2026-02-10T{ts}+00:00"}
+                 for token, ts in ((a, "08:00:00"), (b, "08:15:00"), (a, "08:30:00"), (b, "09:00:00"))]
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": scans})).status_code==200
+        params = {"from":"2026-02-10T07:00:00Z","to":"2026-02-10T10:00:00Z","machine_id":m,"tz":"UTC"}
+        r = await ac.get("/api/v1/reports/utilization", params={**params, "bucket":"hour"})
+        assert r.status_code==200
+        [machine] = r.json()["machines"]
+        assert [x["busy_ratio"] for x in machine["buckets"]]==[0, 1, 0]
+        # shifts start 06:00 Prague = 05:00 UTC; the range sits inside one
+        r = await ac.get("/api/v1/reports/utilization", params={**params, "bucket":"shift", "tz":"Europe/Prague"})
+        [bucket] = r.json()["machines"][0]["buckets"]
+        assert bucket["busy_seconds"]==3600
+
+@pytest.mark.asyncio
+async def test_oee_rollups_fold_late_stops():
+    from app.db.session import engine
+    from app.services import rollups
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        op, m = await _operator_and_machine("oee")
+        cards = [(await _card(ac, f"Oee{i}", 60))[1] for i in range(3)]
+        def scan(card, ts):
+            return {"operator_id":op,"machine_id":m,"qr_payload":card,"ts":f"2026-01-15T{ts}+00:00"}
+        scans = [scan(cards[0], "08:00:00"), scan(cards[1], "08:15:00"), scan(cards[0], "08:30:00"),
+                 scan(cards[2], "08:50:00"), scan(cards[1], "09:10:00")]
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": scans})).status_code==200
+        await rollups.catch_up(engine, lag_seconds=0)
+        params = {"from":"2026-01-15T08:00:00Z","to":"2026-01-15T10:00:00Z","machine_id":m}
+        rows = (await ac.get("/api/v1/reports/oee/machines", params=params)).json()["rows"]
+        assert [(r["pieces"], r["busy_seconds"], r["run_seconds"]) for r in rows]==[(1, 3600, 1800), (1, 600, 3300)]
+        assert rows[0]["availability"]==1 and rows[0]["performance"]==round(60 / 1800, 4)
+
+        # the third piece's stop arrives late and lands in the 08:00 bucket
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": [scan(cards[2], "08:55:00")]})).status_code==200
+        await rollups.catch_up(engine, lag_seconds=0)
+        rows = (await ac.get("/api/v1/reports/oee/machines", params=params)).json()["rows"]
+        assert [(r["pieces"], r["busy_seconds"], r["run_seconds"]) for r in rows]==[(2, 3600, 2100), (1, 600, 3300)]
+        r = await ac.get("/api/v1/reports/oee/operators", params={"from":"2026-01-15T00:00:00Z","to":"2026-01-16T00:00:00Z","operator_id":op})
+        [day] = r.json()["rows"]
+        assert day["pieces"]==3 and day["busy_seconds"]==4200
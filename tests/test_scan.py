@@ -1,9 +1,19 @@
 import pytest
 from httpx import AsyncClient
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal
 from app.main import app
 
+async def _operator_and_machine(name):
+    async with AsyncSessionLocal() as s:
+        op, m = User(username=f"op-{name}"), Machine(name=f"M-{name}")
+        s.add_all([op, m])
+        await s.commit()
+    return op.id, m.id
+
 @pytest.mark.asyncio
 async def test_start_stop_cycle():
+    op, m = await _operator_and_machine("cycle")
     async with AsyncClient(app=app, base_url="http://test") as ac:
         # create job
         r = await ac.post("/api/v1/jobs", json={"name":"Tst", "customer":"X"})
@@ -15,8 +25,122 @@ async def test_start_stop_cycle():
         qc = r3.json()
         token = qc["qr_payload"]
         # start
-        r4 = await ac.post("/api/v1/scan", json={"operator_id":1,"machine_id":1,"qr_payload":token})
+        r4 = await ac.post("/api/v1/scan", json={"operator_id":op,"machine_id":m,"qr_payload":token})
         assert r4.json()["action"]=="started"
         # stop
-        r5 = await ac.post("/api/v1/scan", json={"operator_id":1,"machine_id":1,"qr_payload":token})
+        r5 = await ac.post("/api/v1/scan", json={"operator_id":op,"machine_id":m,"qr_payload":token})
         assert r5.json()["action"]=="stopped"
+
+@pytest.mark.asyncio
+async def test_batch_replay():
+    op, m = await _operator_and_machine("batch")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Tst batch", "customer":"X"})
+        job_id = r.json()["id"]
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":job_id,"drawing_number":"D2","planned_time_per_piece":10,"planned_pieces":2})
+        drawing_id = r2.json()["id"]
+        r3 = await ac.post("/api/v1/jobcards", json={"drawing_id":drawing_id,"card_number":"C2"})
+        token = r3.json()["qr_payload"]
+        scans = [{"operator_id":op,"machine_id":m,"qr_payload":token,"ts":f"2025-01-01T08:00:{s:02d}+00:00"} for s in (0, 30, 40, 55)]
+        scans.insert(2, {"operator_id":op,"machine_id":m,"qr_payload":"garbage","ts":"2025-01-01T08:00:35+00:00"})
+        r4 = await ac.post("/api/v1/scan/batch", json={"scans": scans})
+        assert r4.status_code==200
+        results = r4.json()["results"]
+        assert [x["action"] for x in results]==["started","stopped","error","started","stopped"]
+        assert results[1]["duration_seconds"]==30
+        assert results[4]["done"]==2
+
+@pytest.mark.asyncio
+async def test_idempotent_retry():
+    op, m = await _operator_and_machine("idem")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Tst idem", "customer":"X"})
+        job_id = r.json()["id"]
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":job_id,"drawing_number":"D3","planned_pieces":5})
+        drawing_id = r2.json()["id"]
+        body = {"drawing_id":drawing_id,"card_number":"C3"}
+        r3 = await ac.post("/api/v1/jobcards", json=body, headers={"Idempotency-Key":"card-c3"})
+        r3b = await ac.post("/api/v1/jobcards", json=body, headers={"Idempotency-Key":"card-c3"})
+        assert r3b.json()==r3.json()
+        token = r3.json()["qr_payload"]
+        scan = {"operator_id":op,"machine_id":m,"qr_payload":token}
+        r4 = await ac.post("/api/v1/scan", json=scan, headers={"Idempotency-Key":"scan-1"})
+        r4b = await ac.post("/api/v1/scan", json=scan, headers={"Idempotency-Key":"scan-1"})
+        assert r4.json()["action"]=="started"
+        assert r4b.json()==r4.json()
+        r5 = await ac.post("/api/v1/scan", json={**scan, "machine_id":m + 1}, headers={"Idempotency-Key":"scan-1"})
+        assert r5.status_code==422
+        # the scan queued offline after its answer was lost is not applied twice
+        queued = [{**scan, "ts":"2025-01-01T09:00:00+00:00", "idempotency_key":"scan-1"},
+                  {**scan, "ts":"2025-01-01T09:00:10+00:00", "idempotency_key":"scan-2"}]
+        r6 = await ac.post("/api/v1/scan/batch", json={"scans": queued}, headers={"Idempotency-Key":"batch-1"})
+        assert [(x["action"], x.get("replayed")) for x in r6.json()["results"]]==[("started", True), ("stopped", None)]
+        r7 = await ac.post("/api/v1/scan", json=scan, headers={"Idempotency-Key":"scan-2"})
+        assert r7.json()["action"]=="stopped" and r7.headers["idempotent-replayed"]=="true"
+        # a rejected item keeps nothing under its key, so its retry runs again
+        bad = {**scan, "qr_payload":"garbage"}
+        r8 = await ac.post("/api/v1/scan/batch", json={"scans": [{**bad, "ts":"2025-01-01T09:01:00+00:00", "idempotency_key":"scan-3"}]})
+        assert r8.json()["results"][0]["action"]=="error"
+        r9 = await ac.post("/api/v1/scan", json=bad, headers={"Idempotency-Key":"scan-3"})
+        assert r9.status_code==400
+
+@pytest.mark.asyncio
+async def test_jobs_list_keyset_pages():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        for i in range(5):
+            await ac.post("/api/v1/jobs", json={"name":f"Page {i}", "customer":"Keyset"})
+        seen, cursor = [], None
+        while True:
+            params = {"customer":"Keyset", "sort":"-name", "limit":2}
+            if cursor:
+                params["cursor"] = cursor
+            r = await ac.get("/api/v1/jobs/list", params=params)
+            assert r.status_code==200
+            seen += [j["name"] for j in r.json()["items"]]
+            cursor = r.json()["next_cursor"]
+            if not cursor:
+                break
+        assert seen==[f"Page {i}" for i in reversed(range(5))]
+        r = await ac.get("/api/v1/jobs/list", params={"sort":"id", "cursor":cursor or "bm9wZQ"})
+        assert r.status_code==400
+        r = await ac.get("/api/v1/jobs/export", params={"customer":"Keyset"})
+        assert len(r.text.splitlines())==5
+        # wildcards in the search are matched literally
+        await ac.post("/api/v1/jobs", json={"name":"100% done_x", "customer":"Keyset"})
+        r = await ac.get("/api/v1/jobs/list", params={"customer":"Keyset", "q":"0% done_"})
+        assert [j["name"] for j in r.json()["items"]]==["100% done_x"]
+        r = await ac.get("/api/v1/jobs/list", params={"customer":"Keyset", "q":"P_ge"})
+        assert r.json()["items"]==[]
+
+@pytest.mark.asyncio
+async def test_batch_skips_what_a_live_scan_did_first():
+    import datetime
+    from sqlalchemy import text
+    from app.db.session import engine
+    from app.services import scanning
+    op, m = await _operator_and_machine("race")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Tst race"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-race","planned_pieces":5})
+        card = (await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":"C-race"})).json()
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": [
+            {"operator_id":op,"machine_id":m,"qr_payload":card["qr_payload"],"ts":"2025-03-01T08:00:00+00:00"}]})).status_code==200
+
+    class LiveScanFirst:
+        # a live /scan stops the open piece and starts the next between the batch's read and its writes
+        def __init__(self, conn):
+            self.conn = conn
+        async def execute(self, stmt, *args, **kw):
+            if stmt is scanning.INSERT_SQL:
+                await self.conn.execute(text("UPDATE sessions SET status = 'stopped', stop_ts = start_ts WHERE job_card_id = :id"), {"id": card["id"]})
+                await self.conn.execute(text("INSERT INTO sessions (job_card_id, operator_id, machine_id, piece_index, start_ts, status) "
+                                             "VALUES (:id, :op, :m, 2, '2025-03-01T08:05:00+00:00', 'started')"), {"id": card["id"], "op": op, "m": m})
+            return await self.conn.execute(stmt, *args, **kw)
+
+    ts = datetime.datetime(2025, 3, 1, 8, 10, tzinfo=datetime.timezone.utc)
+    scans = [{"job_card_id": card["id"], "operator_id": op, "machine_id": m, "ts": ts + datetime.timedelta(minutes=n)} for n in (0, 1)]
+    async with engine.begin() as conn:
+        results = await scanning.replay_scans(LiveScanFirst(conn), scans)
+        assert [x["action"] for x in results]==["skipped","skipped"]
+        done = await conn.scalar(text("SELECT done FROM job_card_progress WHERE job_card_id = :id"), {"id": card["id"]})
+        assert done==0
@@ -0,0 +1,42 @@
+import random, pytest
+from httpx import AsyncClient
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal
+from app.main import app
+from app.services import sketch
+
+def test_quantiles_within_relative_error():
+    rng = random.Random(7)
+    durations = [rng.randint(20, 4000) for _ in range(5000)]
+    counts = {}
+    for d in durations:
+        counts[sketch.bucket(d)] = counts.get(sketch.bucket(d), 0) + 1
+    exact = sorted(durations)
+    for q in (0.5, 0.9):
+        est = sketch.quantile(sorted(counts.items()), q)
+        assert abs(est - exact[int(q * (len(exact) - 1))]) <= sketch.ALPHA * exact[int(q * (len(exact) - 1))] + 1
+
+@pytest.mark.asyncio
+async def test_jobcard_progress_eta():
+    async with AsyncSessionLocal() as s:
+        op, machine = User(username="op-sk"), Machine(name="M-sk")
+        s.add_all([op, machine])
+        await s.commit()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        r = await ac.post("/api/v1/jobs", json={"name":"Sketch"})
+        r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":"D-sk","planned_pieces":10})
+        r3 = await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":"C-sk"})
+        card = r3.json()
+        # pieces of 100, 100 and 300 s
+        assert (await ac.post("/api/v1/scan/batch", json={"scans": [
+            {"operator_id":op.id,"machine_id":machine.id,"qr_payload":card["qr_payload"],"ts":f"2025-05-01T08:{m}+00:00"}
+            for m in ("00:00", "01:40", "10:00", "11:40", "20:00", "25:00")]})).status_code==200
+        r = await ac.get(f"/api/v1/jobcards/{card['id']}/progress")
+        assert r.status_code==200
+        p = r.json()
+        assert p["done"]==3 and p["remaining"]==7 and p["pieces_measured"]==3
+        assert abs(p["median_seconds"] - 100) <= 1
+        assert abs(p["eta_seconds"] - 700) <= 10
+        r = await ac.get(f"/api/v1/drawings/{r2.json()['id']}/progress", params={"machine_id": machine.id})
+        assert r.json()["pieces_measured"]==3
+        assert (await ac.get("/api/v1/jobcards/999999/progress")).status_code==404
@@ -0,0 +1,40 @@
+import datetime, pytest
+from httpx import AsyncClient
+from app.db.models import Machine, User
+from app.db.session import AsyncSessionLocal, engine
+from app.main import app
+from app.services import sweeper
+
+@pytest.mark.asyncio
+async def test_sweep_marks_then_cancels_stale_sessions():
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    async with AsyncSessionLocal() as s:
+        op, m = User(username="op-sweep"), Machine(name="M-sweep")
+        s.add_all([op, m])
+        await s.commit()
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        cards = []
+        for name, planned in (("Sw-fast", 60), ("Sw-slow", 3600)):
+            r = await ac.post("/api/v1/jobs", json={"name":name})
+            r2 = await ac.post("/api/v1/drawings", json={"job_id":r.json()["id"],"drawing_number":name,"planned_time_per_piece":planned})
+            cards.append((await ac.post("/api/v1/jobcards", json={"drawing_id":r2.json()["id"],"card_number":name})).json())
+        # both open for an hour: past 30 min for the 60 s part, within 4 x 3600 s for the other
+        started = (now - datetime.timedelta(hours=1)).isoformat()
+        r = await ac.post("/api/v1/scan/batch", json={"scans": [
+            {"operator_id":op.id,"machine_id":m.id,"qr_payload":c["qr_payload"],"ts":started} for c in cards]})
+        fast, slow = [x["session_id"] for x in r.json()["results"]]
+
+        async with engine.begin() as conn:
+            marked = {x["id"] for x in await sweeper.sweep(conn, "mark", now)}
+            again = {x["id"] for x in await sweeper.sweep(conn, "mark", now)}
+        assert fast in marked and slow not in marked and fast not in again
+        async with engine.begin() as conn:
+            cancelled = await sweeper.sweep(conn, "cancel", now)
+        assert fast in {x["id"] for x in cancelled}
+        text = sweeper.alert_text(cancelled, "cancel", now)
+        assert text.startswith(f"{len(cancelled)} forgotten session(s) cancelled") and f"session {fast}:" in text
+
+        # the next scan on the card starts a new piece instead of closing a 1 h one
+        r = await ac.post("/api/v1/scan/batch", json={"scans": [
+            {"operator_id":op.id,"machine_id":m.id,"qr_payload":cards[0]["qr_payload"],"ts":now.isoformat()}]})
+        assert r.json()["results"][0]["action"]=="started"
@@ -0,0 +1,26 @@
+"""Enqueue the periodic maintenance actors; Dramatiq has no scheduler of its own."""
+import time
+from worker import maintain_session_partitions, purge_idempotency_keys, archive_sessions, rollup_stats, sweep_stale_sessions, trim_pdf_cache
+
+# (actor, interval in seconds)
+JOBS = [
+    (maintain_session_partitions, 6 * 3600),
+    (purge_idempotency_keys, 3600),
+    (archive_sessions, 24 * 3600),
+    (rollup_stats, 60),
+    (sweep_stale_sessions, 300),
+    (trim_pdf_cache, 3600),
+]
+
+def main():
+    due = {actor.actor_name: 0.0 for actor, _ in JOBS}
+    while True:
+        now = time.time()
+        for actor, every in JOBS:
+            if now >= due[actor.actor_name]:
+                actor.send()
+                due[actor.actor_name] = now + every
+        time.sleep(30)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 import dramatiq
 from dramatiq.brokers.redis import RedisBroker
 from app.services.notifier import send_telegram, send_email
-from app.services.pdfgen import generate_job_card_pdf
-from app.db.session import AsyncSessionLocal
+from app.services import pdfcache
+from app.db.session import task_engine
 from app.db.models import JobCard, Drawing
 import asyncio
 
@@ -22,16 +22,87 @@ def notify_email(subject, body, to_email):
 @dramatiq.actor
 def generate_and_store_pdf(jobcard_id):
     import asyncio
+    from sqlalchemy.ext.asyncio import AsyncSession
     from sqlalchemy.future import select
     async def _run():
-        async with AsyncSessionLocal() as s:
+        async with task_engine() as engine, AsyncSession(engine) as s:
             r = await s.execute(select(JobCard).where(JobCard.id==jobcard_id))
             jc = r.scalar_one_or_none()
             if not jc: return
             r2 = await s.execute(select(Drawing).where(Drawing.id==jc.drawing_id))
             dr = r2.scalar_one_or_none()
-            pdf = generate_job_card_pdf(jc, dr)
-            path = f"/tmp/jobcard_{jobcard_id}.pdf"
-            with open(path, "wb") as f:
-                f.write(pdf)
+            if not dr: return
+        # warms the cache GET /jobcard/{id}/pdf serves from
+        pdfcache.get_or_create(jc, dr)
+    asyncio.run(_run())
+
+@dramatiq.actor
+def trim_pdf_cache():
+    pdfcache.evict()
+
+@dramatiq.actor
+def purge_idempotency_keys():
+    # expired keys are already ignored by the API; this only reclaims space
+    import asyncio, datetime
+    from sqlalchemy import delete
+    from app.core.config import settings
+    from app.db.models import IdempotencyKey
+    async def _run():
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        async with task_engine() as engine, engine.begin() as conn:
+            await conn.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    asyncio.run(_run())
+
+@dramatiq.actor
+def maintain_session_partitions():
+    import asyncio, logging
+    from app.core.config import settings
+    from app.services import partitions
+    async def _run():
+        async with task_engine() as engine, engine.begin() as conn:
+            created = await partitions.ensure_partitions(conn, settings.SESSIONS_PARTITIONS_AHEAD)
+            detached = await partitions.detach_old_partitions(conn, settings.SESSIONS_RETENTION_MONTHS)
+        if created or detached:
+            logging.getLogger(__name__).info("sessions partitions: created %s, detached %s", created, detached)
+    asyncio.run(_run())
+
+@dramatiq.actor(time_limit=6 * 3600 * 1000)
+def archive_sessions():
+    import asyncio
+    from app.core.config import settings
+    from app.services import archive
+    async def _run():
+        if settings.ARCHIVE_AFTER_MONTHS > 0:
+            async with task_engine() as engine:
+                await archive.archive_old_sessions(engine, settings.ARCHIVE_AFTER_MONTHS)
+    asyncio.run(_run())
+
+@dramatiq.actor(time_limit=3600 * 1000)
+def rollup_stats():
+    import asyncio, logging
+    from app.services import rollups
+    async def _run():
+        async with task_engine() as engine:
+            n = await rollups.catch_up(engine)
+        if n:
+            logging.getLogger(__name__).info("rollups: folded %d stopped sessions", n)
+    asyncio.run(_run())
+
+@dramatiq.actor
+def sweep_stale_sessions():
+    import asyncio, logging
+    from app.core.config import settings
+    from app.services import sweeper
+    async def _run():
+        swept = []
+        async with task_engine() as engine:
+            while True:
+                async with engine.begin() as conn:
+                    rows = await sweeper.sweep(conn)
+                swept += rows
+                if len(rows) < settings.SESSION_STALE_BATCH:
+                    break
+        if swept:
+            logging.getLogger(__name__).info("swept %d stale sessions", len(swept))
+            await send_telegram(sweeper.alert_text(swept, settings.SESSION_STALE_MODE))
     asyncio.run(_run())